@@ -0,0 +1,74 @@
+"""封面解码测试: 对比旧版(完整解码 + LANCZOS)与 draft 缩放解码生成缩略图的单张耗时
+
+使用不同尺寸的照片型 JPEG 封面和带透明通道的 PNG 封面, 分别统计每张封面生成缩略图的耗时中位数。
+
+需要在安装了 AstrBot 的环境中运行:
+    python benchmarks/bench_cover_decode.py --sizes 300 800 1600 3000 --repeat 20
+"""
+import argparse
+import io
+import os
+import statistics
+import sys
+import time
+
+from PIL import Image, ImageDraw
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_api import make_cover_bytes  # noqa: E402
+from main import MusicSearchDrawer  # noqa: E402
+
+
+def make_png_cover(size: int) -> bytes:
+    """生成一张带透明背景的 PNG 封面"""
+    img = Image.new("RGBA", (size, size), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(img)
+    draw.ellipse((size // 8, size // 8, size * 7 // 8, size * 7 // 8), fill=(200, 60, 90, 255))
+    with io.BytesIO() as output:
+        img.save(output, format="PNG")
+        return output.getvalue()
+
+
+def legacy_thumbnail(data: bytes) -> bytes:
+    """旧版缩略图生成: 完整解码后直接缩放"""
+    size = MusicSearchDrawer.COVER_SIZE
+    cover_img = Image.open(io.BytesIO(data)).convert("RGB")
+    cover_img = cover_img.resize((size, size), Image.Resampling.LANCZOS)
+    with io.BytesIO() as output:
+        cover_img.save(output, format="JPEG", quality=90)
+        return output.getvalue()
+
+
+def measure(fn, data: bytes, repeat: int) -> float:
+    """返回单次调用耗时的中位数(秒)"""
+    fn(data)  # 预热
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(data)
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[300, 800, 1600, 3000], help="封面边长(可多个)")
+    parser.add_argument("--repeat", type=int, default=20, help="每种封面的重复次数")
+    args = parser.parse_args()
+
+    samples = []
+    for size in args.sizes:
+        samples.append((f"JPEG {size}x{size}", make_cover_bytes(size, size)))
+        samples.append((f"PNG RGBA {size}x{size}", make_png_cover(size)))
+
+    for name, data in samples:
+        legacy = measure(legacy_thumbnail, data, args.repeat)
+        current = measure(MusicSearchDrawer.make_thumbnail, data, args.repeat)
+        print(f"{name} ({len(data) / 1024:.0f} KB): 旧版 {legacy * 1000:.2f} ms, "
+              f"当前 {current * 1000:.2f} ms, 加速 {legacy / current:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
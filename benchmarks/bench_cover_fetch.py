@@ -0,0 +1,100 @@
+"""封面下载耗时对比: 旧版逐张顺序下载 vs 并发下载
+
+在本地启动一个模拟封面接口(每张封面带随机延迟, 少量封面极慢),
+分别用旧版的顺序循环和 MusicSearchDrawer.fetch_covers 下载同一组封面并对比耗时。
+
+需要在安装了 AstrBot 的环境中运行:
+    python benchmarks/bench_cover_fetch.py --songs 20 --rounds 5
+"""
+import argparse
+import asyncio
+import io
+import os
+import random
+import sys
+import time
+
+import aiohttp
+from aiohttp import web
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import MusicSearchDrawer  # noqa: E402
+
+
+def make_cover_bytes() -> bytes:
+    """生成一张 300x300 的 JPEG 封面"""
+    img = Image.new("RGB", (300, 300), (random.randint(0, 255), random.randint(0, 255), random.randint(0, 255)))
+    with io.BytesIO() as output:
+        img.save(output, format="JPEG", quality=85)
+        return output.getvalue()
+
+
+async def start_server(min_delay: float, max_delay: float, slow_ratio: float, slow_delay: float):
+    """启动模拟封面接口"""
+    cover = make_cover_bytes()
+
+    async def handle_cover(request):
+        delay = slow_delay if random.random() < slow_ratio else random.uniform(min_delay, max_delay)
+        await asyncio.sleep(delay)
+        return web.Response(body=cover, content_type="image/jpeg")
+
+    app = web.Application()
+    app.router.add_get("/api/music/cover/{song_id}", handle_cover)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}"
+
+
+async def fetch_sequential(session, songs):
+    """旧版逻辑: 绘制循环中逐张下载, 每张 8s 超时"""
+    covers = []
+    for song_info in songs:
+        try:
+            async with session.get(song_info["cover_url"], timeout=8) as cover_response:
+                covers.append(await cover_response.read() if cover_response.status == 200 else None)
+        except Exception:
+            covers.append(None)
+    return covers
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--songs", type=int, default=20, help="每次搜索的歌曲数")
+    parser.add_argument("--rounds", type=int, default=5, help="重复轮数")
+    parser.add_argument("--concurrency", type=int, default=8, help="并发下载数")
+    parser.add_argument("--deadline", type=float, default=6.0, help="封面下载总超时(秒)")
+    parser.add_argument("--min-delay", type=float, default=0.05)
+    parser.add_argument("--max-delay", type=float, default=0.4)
+    parser.add_argument("--slow-ratio", type=float, default=0.05, help="极慢封面的比例")
+    parser.add_argument("--slow-delay", type=float, default=7.0, help="极慢封面的延迟(秒)")
+    args = parser.parse_args()
+
+    random.seed(0)
+    runner, base_url = await start_server(args.min_delay, args.max_delay, args.slow_ratio, args.slow_delay)
+    songs = [{"cover_url": f"{base_url}/api/music/cover/{i}"} for i in range(args.songs)]
+    drawer = MusicSearchDrawer(cover_concurrency=args.concurrency, cover_deadline=args.deadline)
+
+    try:
+        async with aiohttp.ClientSession() as session:
+            for name, fetch in (("顺序下载", lambda: fetch_sequential(session, songs)),
+                                ("并发下载", lambda: drawer.fetch_covers(session, songs))):
+                elapsed = []
+                missing = 0
+                for _ in range(args.rounds):
+                    start = time.perf_counter()
+                    covers = await fetch()
+                    elapsed.append(time.perf_counter() - start)
+                    missing += sum(1 for c in covers if c is None)
+                print(f"{name}: 平均 {sum(elapsed) / len(elapsed):.2f}s, 最慢 {max(elapsed):.2f}s, "
+                      f"占位封面 {missing}/{args.songs * args.rounds}")
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,94 @@
+"""搜索结果图片编码测试: 各输出格式的编码耗时与图片大小
+
+使用带噪点的"照片型"封面构造不同歌曲数的结果图, 依次用各编码方式编码并统计。
+
+需要在安装了 AstrBot 的环境中运行:
+    python benchmarks/bench_encode.py --songs 5 20 30 --repeat 5
+"""
+import argparse
+import io
+import os
+import random
+import sys
+import time
+
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import MusicSearchDrawer  # noqa: E402
+
+# (名称, 格式, 质量, PNG 压缩级别)
+MODES = [
+    ("PNG optimize(旧版)", "png-optimize", 0, 9),
+    ("PNG level 9", "png", 0, 9),
+    ("PNG level 6", "png", 0, 6),
+    ("PNG level 1", "png", 0, 1),
+    ("JPEG q90", "jpeg", 90, 0),
+    ("JPEG q85", "jpeg", 85, 0),
+    ("JPEG q70", "jpeg", 70, 0),
+    ("WebP q85", "webp", 85, 0),
+    ("WebP q70", "webp", 70, 0),
+]
+
+
+def make_photo_cover(seed: int) -> bytes:
+    """生成带噪点和渐变的照片型封面缩略图"""
+    rng = random.Random(seed)
+    base = Image.linear_gradient("L").resize((100, 100)).convert("RGB")
+    tint = Image.new("RGB", (100, 100), (rng.randint(0, 255), rng.randint(0, 255), rng.randint(0, 255)))
+    noise = Image.effect_noise((100, 100), 60).convert("RGB")
+    cover = Image.blend(Image.blend(base, tint, 0.5), noise, 0.3)
+    with io.BytesIO() as output:
+        cover.save(output, format="JPEG", quality=90)
+        return output.getvalue()
+
+
+def make_result(songs: int):
+    """构造搜索结果和封面"""
+    result_data = {"songs": [], "total": songs}
+    for i in range(songs):
+        result_data["songs"].append({
+            "song_id": i + 1,
+            "cover_url": f"https://music.cnmsb.xin/api/music/cover/{i + 1}",
+            "text": f"测试歌曲 {i + 1}\n歌手: 测试歌手\n专辑: 测试专辑\n平台音乐ID: {i + 1}",
+        })
+    return result_data, [make_photo_cover(i) for i in range(songs)]
+
+
+def encode(img: Image.Image, image_format: str, quality: int, compress_level: int) -> bytes:
+    """编码图片"""
+    if image_format == "png-optimize":
+        with io.BytesIO() as output:
+            img.save(output, format="PNG", optimize=True)
+            return output.getvalue()
+    return MusicSearchDrawer._encode(img, image_format, quality, compress_level)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--songs", type=int, nargs="+", default=[5, 20, 30], help="结果歌曲数(可多个)")
+    parser.add_argument("--repeat", type=int, default=5, help="每种编码重复次数")
+    args = parser.parse_args()
+
+    drawer = MusicSearchDrawer()
+    for songs in args.songs:
+        result_data, covers = make_result(songs)
+        img = drawer.compose_search_result("测试", result_data, covers)
+        print(f"\n{songs} 首歌曲 ({img.width}x{img.height}):")
+        print(f"{'编码方式':<20}{'耗时(ms)':>10}{'大小(KB)':>10}")
+        for name, image_format, quality, compress_level in MODES:
+            try:
+                data = encode(img, image_format, quality, compress_level)
+            except (KeyError, OSError) as e:
+                print(f"{name:<20}不支持: {e}")
+                continue
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                encode(img, image_format, quality, compress_level)
+            elapsed = (time.perf_counter() - start) / args.repeat * 1000
+            print(f"{name:<20}{elapsed:>10.1f}{len(data) / 1024:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""离线压测: 用本地模拟 API 驱动点歌和播放流程
+
+启动 fake_api.py 中的模拟接口, 将插件的 api_base_url 指向它, 然后模拟 N 个会话并发
+执行「点歌 → 回复序号播放」, 统计各操作的 p50/p95/p99 耗时、吞吐、峰值内存和事件循环延迟,
+最后输出插件自身的分阶段统计。
+
+需要在安装了 AstrBot 的环境中运行:
+    python benchmarks/bench_load.py --sessions 20 --rounds 5 --keywords 10
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from types import SimpleNamespace
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_api import add_arguments, options_from_args, start_fake_api  # noqa: E402
+from main import Main  # noqa: E402
+
+
+class FakeEvent:
+    """只实现插件用到的 AstrMessageEvent 接口"""
+
+    def __init__(self, message_str: str, session_id: str, reply=None, platform: str = "aiocqhttp",
+                 sender_id: str = ""):
+        self.message_str = message_str
+        self.session_id = session_id
+        self.sender_id = sender_id or session_id
+        self.platform = platform
+        self.message_obj = SimpleNamespace(message=[reply] if reply is not None else [])
+
+    def get_self_id(self) -> str:
+        return "bot"
+
+    def get_sender_id(self) -> str:
+        return self.sender_id
+
+    def plain_result(self, text: str):
+        return ("plain", text)
+
+    def chain_result(self, chain: list):
+        return ("chain", chain)
+
+
+def percentile(samples, q: float) -> float:
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+def peak_rss_mb() -> float:
+    """本进程和已结束子进程的峰值常驻内存(MB)，渲染进程池的子进程在关闭后才计入"""
+    if resource is None:
+        return 0.0
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) / scale
+
+
+async def monitor_loop_lag(lags: list, interval: float = 0.01):
+    """定期睡眠 interval, 记录实际唤醒时间超出的部分作为事件循环延迟"""
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - start - interval)
+
+
+async def drain(gen) -> list:
+    return [result async for result in gen]
+
+
+async def run_session(plugin: Main, session_no: int, args, keywords, latencies: dict, failures: dict):
+    """一个会话: 多轮「搜索 → 播放其中一首」"""
+    rng = random.Random(session_no)
+    session_id = f"bench-{session_no}"
+    for round_no in range(args.rounds):
+        keyword = rng.choice(keywords)
+        start = time.perf_counter()
+        results = await drain(plugin.search_music(FakeEvent(f"点歌 {keyword}", session_id)))
+        latencies["search"].append(time.perf_counter() - start)
+        chains = [payload for kind, payload in results if kind == "chain"]
+        if not chains:
+            failures["search"] += 1
+            continue
+
+        if args.no_play:
+            continue
+        await asyncio.sleep(args.think_time)
+        hint_text = chains[0][0].text
+        reply = SimpleNamespace(type="Reply", id=f"{session_id}-{round_no}", sender_id="bot", message_str=hint_text)
+        index = 1 if rng.random() < args.first_ratio else rng.randint(1, args.songs)
+        start = time.perf_counter()
+        results = await drain(plugin.play_music(FakeEvent(str(index), session_id, reply)))
+        latencies["play"].append(time.perf_counter() - start)
+        if not any(kind == "chain" and type(payload[0]).__name__ == "Record" for kind, payload in results):
+            failures["play"] += 1
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_arguments(parser)
+    parser.add_argument("--sessions", type=int, default=20, help="并发会话数")
+    parser.add_argument("--rounds", type=int, default=5, help="每个会话的搜索轮数")
+    parser.add_argument("--keywords", type=int, default=10, help="关键词数量(越少搜索和封面缓存命中越多)")
+    parser.add_argument("--render-mode", choices=["thread", "process"], default="thread", help="渲染方式")
+    parser.add_argument("--no-play", action="store_true", help="只压测搜索, 不播放")
+    parser.add_argument("--think-time", type=float, default=0.0, help="搜索结果展示后到回复序号的间隔(秒)")
+    parser.add_argument("--first-ratio", type=float, default=0.5, help="选择第 1 首的比例, 其余随机选择")
+    parser.add_argument("--prefetch", type=int, default=0, help="预取前几首歌曲的音频, 0 表示关闭")
+    args = parser.parse_args()
+
+    runner, base_url, api_stats = await start_fake_api(options_from_args(args))
+    plugin = Main(None, {"api_base_url": base_url, "render_mode": args.render_mode,
+                         "audio_prefetch_count": args.prefetch})
+    keywords = [f"关键词{i}" for i in range(args.keywords)]
+    latencies = {"search": [], "play": []}
+    failures = {"search": 0, "play": 0}
+    lags = []
+    lag_task = asyncio.create_task(monitor_loop_lag(lags))
+
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(*(run_session(plugin, i, args, keywords, latencies, failures)
+                               for i in range(args.sessions)))
+        elapsed = time.perf_counter() - start
+    finally:
+        lag_task.cancel()
+        await plugin.terminate()
+        await runner.cleanup()
+
+    print(f"会话 {args.sessions} × {args.rounds} 轮, 总耗时 {elapsed:.2f}s, 模拟接口请求: {api_stats}")
+    for name, samples in latencies.items():
+        if not samples:
+            continue
+        print(f"{name}: {len(samples)} 次, 失败 {failures[name]}, 吞吐 {len(samples) / elapsed:.2f}/s, "
+              f"p50/p95/p99 = {percentile(samples, 0.50) * 1000:.0f}/{percentile(samples, 0.95) * 1000:.0f}/"
+              f"{percentile(samples, 0.99) * 1000:.0f} ms")
+    print(f"事件循环延迟: p99 {percentile(lags, 0.99) * 1000:.1f} ms, 最大 {max(lags, default=0) * 1000:.1f} ms")
+    print(f"峰值内存: {peak_rss_mb():.1f} MB")
+    print()
+    print(plugin.metrics.summary(plugin._metrics_extra()))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
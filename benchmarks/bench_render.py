@@ -0,0 +1,84 @@
+"""搜索结果图片渲染吞吐测试: 旧版逐行渐变 + 全量重绘 vs 静态模板层
+
+分别统计纯绘制(不含编码)和绘制+PNG 编码的每秒渲染次数。
+
+需要在安装了 AstrBot 的环境中运行:
+    python benchmarks/bench_render.py --songs 20 --seconds 5
+"""
+import argparse
+import io
+import os
+import sys
+import time
+
+from PIL import Image, ImageDraw
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import MusicSearchDrawer  # noqa: E402
+
+
+class LegacyDrawer(MusicSearchDrawer):
+    """旧版渲染方式: 每次逐行绘制渐变, 不缓存模板层"""
+
+    @staticmethod
+    def _make_gradient(width, height, start, end):
+        img = Image.new("RGB", (width, height))
+        draw = ImageDraw.Draw(img)
+        for y in range(height):
+            r = int(start[0] + (end[0] - start[0]) * y / height)
+            g = int(start[1] + (end[1] - start[1]) * y / height)
+            b = int(start[2] + (end[2] - start[2]) * y / height)
+            draw.line([(0, y), (width, y)], fill=(r, g, b))
+        return img
+
+    def _get_template(self, rows, start=0):
+        return self._build_template(rows, start)
+
+
+def make_result(songs: int):
+    """构造搜索结果和缩略图"""
+    result_data = {"songs": [], "total": songs}
+    covers = []
+    for i in range(songs):
+        result_data["songs"].append({
+            "song_id": i + 1,
+            "cover_url": f"https://music.cnmsb.xin/api/music/cover/{i + 1}",
+            "text": f"测试歌曲 {i + 1}\n歌手: 测试歌手\n专辑: 测试专辑\n平台音乐ID: {i + 1}",
+        })
+        with io.BytesIO() as output:
+            Image.new("RGB", (100, 100), (i * 10 % 255, 120, 200)).save(output, format="JPEG", quality=90)
+            covers.append(output.getvalue())
+    return result_data, covers
+
+
+def measure(fn, seconds: float) -> float:
+    """在给定时间内重复执行 fn, 返回每秒执行次数"""
+    fn()  # 预热(模板缓存、字体等)
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        fn()
+        count += 1
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--songs", type=int, default=20, help="结果歌曲数")
+    parser.add_argument("--seconds", type=float, default=5.0, help="每项测试时长(秒)")
+    args = parser.parse_args()
+
+    result_data, covers = make_result(args.songs)
+    for name, drawer in (("旧版", LegacyDrawer()), ("模板层", MusicSearchDrawer())):
+        gradient_rate = measure(lambda: drawer._make_gradient(drawer.IMG_WIDTH, 2500, drawer.COLOR_BG_START,
+                                                              drawer.COLOR_BG_END), args.seconds)
+        template_rate = measure(lambda: drawer._get_template(args.songs), args.seconds)
+        compose_rate = measure(lambda: drawer.compose_search_result("测试", result_data, covers), args.seconds)
+        full_rate = measure(lambda: drawer.render_search_result("测试", result_data, covers), args.seconds)
+        print(f"{name}: 渐变背景 {gradient_rate:.1f} 次/秒, 静态层 {template_rate:.1f} 次/秒, "
+              f"绘制 {compose_rate:.1f} 次/秒, 绘制+编码 {full_rate:.2f} 次/秒")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""插件启动耗时测试: 导入与注册、插件初始化、首次渲染(含字体解析)和后续渲染
+
+每轮在新的子进程中执行, 避免模块和字体缓存影响结果, 最后输出各阶段耗时的中位数。
+使用 --eager-fonts 可模拟旧版在初始化时立即加载全部字体的启动开销。
+
+需要在安装了 AstrBot 的环境中运行:
+    python benchmarks/bench_startup.py --runs 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD_SCRIPT = r"""
+import json, sys, time
+sys.path.insert(0, {root!r})
+t0 = time.perf_counter()
+import main
+t1 = time.perf_counter()
+plugin = main.Main(None, {{}})
+if {eager_fonts!r}:
+    drawer = plugin.drawer
+    for font in (drawer.font_title, drawer.font_subtitle, drawer.font_song_name, drawer.font_song_info, drawer.font_footer):
+        pass
+t2 = time.perf_counter()
+result = {{"songs": [{{"cover_url": None, "text": f"歌曲 {{i}}\n歌手: 测试\n专辑: 测试"}} for i in range({songs})], "total": {songs}}}
+plugin.drawer.render_search_result("测试", result, [None] * {songs})
+t3 = time.perf_counter()
+plugin.drawer.render_search_result("测试", result, [None] * {songs})
+t4 = time.perf_counter()
+print(json.dumps({{"导入与注册": t1 - t0, "插件初始化": t2 - t1, "首次渲染": t3 - t2, "再次渲染": t4 - t3}}))
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="子进程运行次数")
+    parser.add_argument("--songs", type=int, default=10, help="渲染的歌曲数")
+    parser.add_argument("--eager-fonts", action="store_true", help="初始化时立即加载全部字体")
+    args = parser.parse_args()
+
+    script = CHILD_SCRIPT.format(root=ROOT, eager_fonts=args.eager_fonts, songs=args.songs)
+    samples = {}
+    for _ in range(args.runs):
+        output = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True)
+        timings = json.loads(output.stdout.strip().splitlines()[-1])
+        for stage, seconds in timings.items():
+            samples.setdefault(stage, []).append(seconds)
+
+    for stage, values in samples.items():
+        print(f"{stage}: 中位数 {statistics.median(values) * 1000:.1f} ms, "
+              f"最小 {min(values) * 1000:.1f} ms, 最大 {max(values) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""音频转码测试: 各目标格式的转码耗时、文件大小和估算的上传耗时
+
+未指定 --input 时用 ffmpeg 生成一段立体声 FLAC 作为无损源文件。上传耗时按 --uplink-mbps
+估算(文件大小 / 上行带宽), 用于对比直接发送原始文件与发送转码结果的差异。
+
+需要在安装了 AstrBot 和 ffmpeg 的环境中运行:
+    python benchmarks/bench_transcode.py --duration 240 --uplink-mbps 10
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import AudioCache, AudioDownloader, AudioTranscoder, TranscodeError  # noqa: E402
+
+
+def make_source(ffmpeg: str, path: str, duration: int):
+    """生成带噪声的立体声 FLAC(噪声使其压缩率接近真实音乐)"""
+    subprocess.run([
+        ffmpeg, "-nostdin", "-hide_banner", "-loglevel", "error", "-y",
+        "-f", "lavfi", "-i", f"sine=frequency=440:sample_rate=44100:duration={duration}",
+        "-f", "lavfi", "-i", f"anoisesrc=color=pink:amplitude=0.2:sample_rate=44100:duration={duration}",
+        "-filter_complex", "[0:a][1:a]amerge=inputs=2", "-c:a", "flac", path,
+    ], check=True)
+
+
+async def run(args, work_dir: str):
+    transcoder = AudioTranscoder(
+        AudioCache(os.path.join(work_dir, "cache"), max_bytes=1 << 40, downloader=AudioDownloader(1, 1)),
+        ffmpeg_path=args.ffmpeg,
+        concurrency=1,
+        bitrates={"opus": args.opus_bitrate, "mp3": args.mp3_bitrate},
+    )
+    if not transcoder.enabled:
+        print("未找到 ffmpeg, 请安装或通过 --ffmpeg 指定路径")
+        return
+
+    source = args.input
+    if not source:
+        source = os.path.join(work_dir, "source.flac")
+        make_source(transcoder.ffmpeg, source, args.duration)
+    source_size = os.path.getsize(source)
+    uplink = args.uplink_mbps * 1024 * 1024 / 8
+    print(f"源文件: {source_size / 1024 / 1024:.2f} MB, 估算上传 {source_size / uplink:.2f}s")
+
+    for profile in args.profiles:
+        start = time.perf_counter()
+        try:
+            path = await transcoder.transcode("bench", source, profile)
+        except TranscodeError as e:
+            print(f"{profile}: 转码失败 ({str(e)})")
+            continue
+        elapsed = time.perf_counter() - start
+        size = transcoder.cache.size(path)
+        await transcoder.cache.release(path)
+        print(f"{profile}: 转码 {elapsed:.2f}s, {size / 1024 / 1024:.2f} MB (原始的 {size / source_size:.1%}), "
+              f"估算上传 {size / uplink:.2f}s, 节省 {(source_size - size) / uplink:.2f}s")
+
+        # 再次获取同一格式应直接命中缓存
+        start = time.perf_counter()
+        path = await transcoder.transcode("bench", source, profile)
+        await transcoder.cache.release(path)
+        print(f"{profile}: 缓存命中 {(time.perf_counter() - start) * 1000:.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--input", default="", help="源音频文件, 留空则生成")
+    parser.add_argument("--duration", type=int, default=240, help="生成的源音频时长(秒)")
+    parser.add_argument("--profiles", nargs="+", default=["opus", "mp3", "amr"],
+                        choices=sorted(AudioTranscoder.PROFILES), help="目标格式(可多个)")
+    parser.add_argument("--opus-bitrate", type=int, default=64, help="Opus 码率(kbps)")
+    parser.add_argument("--mp3-bitrate", type=int, default=128, help="MP3 码率(kbps)")
+    parser.add_argument("--uplink-mbps", type=float, default=10, help="估算上传耗时使用的上行带宽(Mbps)")
+    parser.add_argument("--ffmpeg", default="", help="ffmpeg 路径, 留空则从 PATH 中查找")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        asyncio.run(run(args, work_dir))
+
+
+if __name__ == "__main__":
+    main()
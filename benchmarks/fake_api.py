@@ -0,0 +1,149 @@
+"""本地模拟音乐 API: 提供搜索、封面和音频接口, 延迟、数据大小和失败率均可配置
+
+供 bench_load.py 压测使用, 也可以单独运行后把插件的 api_base_url 指向它进行手动测试:
+    python benchmarks/fake_api.py --port 8080 --min-delay 0.05 --max-delay 0.3
+"""
+import argparse
+import asyncio
+import io
+import random
+from dataclasses import dataclass
+
+from aiohttp import web
+from PIL import Image
+
+
+@dataclass
+class FakeApiOptions:
+    """模拟接口参数"""
+
+    songs: int = 20               # 每次搜索返回的歌曲数
+    min_delay: float = 0.02       # 每个请求的最小延迟(秒)
+    max_delay: float = 0.2        # 每个请求的最大延迟(秒)
+    fail_rate: float = 0.0        # 返回 500 的请求比例
+    cover_size: int = 300         # 封面边长(像素)
+    audio_kb: int = 4096          # 音频大小(KB)
+    chunk_kb: int = 64            # 音频分块发送大小(KB)
+
+
+def make_cover_bytes(size: int, seed: int) -> bytes:
+    """生成一张带噪点的 JPEG 封面(比纯色图更接近真实封面的编码大小)"""
+    rng = random.Random(seed)
+    base = Image.new("RGB", (size, size), (rng.randint(0, 255), rng.randint(0, 255), rng.randint(0, 255)))
+    noise = Image.effect_noise((size, size), 48).convert("RGB")
+    img = Image.blend(base, noise, 0.35)
+    with io.BytesIO() as output:
+        img.save(output, format="JPEG", quality=85)
+        return output.getvalue()
+
+
+def create_app(options: FakeApiOptions) -> web.Application:
+    """创建模拟接口应用"""
+    covers = [make_cover_bytes(options.cover_size, seed) for seed in range(16)]
+    chunk = random.Random(0).randbytes(options.chunk_kb * 1024)
+    audio_size = options.audio_kb * 1024
+    stats = {"search": 0, "cover": 0, "file": 0, "failed": 0}
+
+    async def delay_or_fail(kind: str) -> bool:
+        stats[kind] += 1
+        await asyncio.sleep(random.uniform(options.min_delay, options.max_delay))
+        if random.random() < options.fail_rate:
+            stats["failed"] += 1
+            return True
+        return False
+
+    async def handle_search(request):
+        body = await request.json()
+        if await delay_or_fail("search"):
+            return web.Response(status=500, text="模拟失败")
+        keyword = str(body.get("query", ""))
+        seed = sum(keyword.encode("utf-8"))
+        results = [
+            {
+                "id": seed * 1000 + i + 1,
+                "name": f"{keyword} {i + 1}",
+                "artist": f"歌手 {i % 7 + 1}",
+                "album": f"专辑 {i % 5 + 1}",
+            }
+            for i in range(options.songs)
+        ]
+        return web.json_response({"success": True, "results": results})
+
+    async def handle_cover(request):
+        if await delay_or_fail("cover"):
+            return web.Response(status=500, text="模拟失败")
+        song_id = int(request.match_info["song_id"])
+        return web.Response(body=covers[song_id % len(covers)], content_type="image/jpeg")
+
+    async def handle_file(request):
+        if await delay_or_fail("file"):
+            return web.Response(status=500, text="模拟失败")
+        response = web.StreamResponse(headers={"Content-Type": "audio/mpeg"})
+        response.content_length = audio_size
+        try:
+            await response.prepare(request)
+            remaining = audio_size
+            while remaining > 0:
+                data = chunk[:remaining]
+                await response.write(data)
+                remaining -= len(data)
+            await response.write_eof()
+        except ConnectionError:
+            # 客户端取消下载(如预取被取消)
+            pass
+        return response
+
+    app = web.Application()
+    app["stats"] = stats
+    app.router.add_post("/api/music/search", handle_search)
+    app.router.add_get("/api/music/cover/{song_id}", handle_cover)
+    app.router.add_get("/api/music/file/{song_id}", handle_file)
+    return app
+
+
+async def start_fake_api(options: FakeApiOptions, host: str = "127.0.0.1", port: int = 0):
+    """启动模拟接口, 返回 (runner, base_url, stats)"""
+    app = create_app(options)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://{host}:{port}", app["stats"]
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    """添加模拟接口的命令行参数"""
+    parser.add_argument("--songs", type=int, default=20, help="每次搜索返回的歌曲数")
+    parser.add_argument("--min-delay", type=float, default=0.02, help="接口最小延迟(秒)")
+    parser.add_argument("--max-delay", type=float, default=0.2, help="接口最大延迟(秒)")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="接口返回 500 的比例")
+    parser.add_argument("--cover-size", type=int, default=300, help="封面边长(像素)")
+    parser.add_argument("--audio-kb", type=int, default=4096, help="音频大小(KB)")
+
+
+def options_from_args(args) -> FakeApiOptions:
+    return FakeApiOptions(songs=args.songs, min_delay=args.min_delay, max_delay=args.max_delay,
+                          fail_rate=args.fail_rate, cover_size=args.cover_size, audio_kb=args.audio_kb)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_arguments(parser)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    args = parser.parse_args()
+
+    runner, base_url, _ = await start_fake_api(options_from_args(args), args.host, args.port)
+    print(f"模拟接口已启动: {base_url} (Ctrl+C 退出)")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
@@ -1,24 +1,1531 @@
+import asyncio
+import contextlib
+import functools
+import hashlib
 import io
 import os
+import random
+import re
+import shutil
+import string
+import sys
 import textwrap
-from typing import Dict, List, Tuple
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
 
 import aiohttp
-from PIL import Image, ImageDraw, ImageFont
+from aiohttp import web
+from PIL import Image, ImageDraw, ImageFont, ImageOps, features
 from astrbot.api.event import filter, AstrMessageEvent
-from astrbot.api.star import Context, Star, register
-from astrbot.api import logger
+from astrbot.api.star import Context, Star, StarTools, register
+from astrbot.api import logger, AstrBotConfig
 import astrbot.api.message_components as Comp
 
 
+# 音乐 API 默认地址，可通过 api_base_url 配置项替换（如指向本地模拟接口进行压测）
+DEFAULT_API_BASE_URL = "https://music.cnmsb.xin"
+
+
+class StageStats:
+    """单个阶段的耗时与计数"""
+
+    __slots__ = ("count", "errors", "inflight", "total", "buckets", "samples")
+
+    def __init__(self, bucket_count: int, sample_size: int):
+        self.count = 0
+        self.errors = 0
+        self.inflight = 0
+        self.total = 0.0
+        self.buckets = [0] * bucket_count
+        self.samples: deque = deque(maxlen=sample_size)
+
+
+class Metrics:
+    """各阶段耗时、吞吐、错误和并发统计，可导出为 Prometheus 文本格式
+
+    只在事件循环线程中更新，不需要加锁。
+    """
+
+    # 耗时直方图分桶(秒)
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+    # 计算分位数时保留的最近样本数
+    SAMPLE_SIZE = 1024
+
+    def __init__(self):
+        self._stages: Dict[str, StageStats] = {}
+        self._bytes: Dict[str, int] = {}
+        self.started = time.time()
+
+    def _stage(self, stage: str) -> StageStats:
+        stats = self._stages.get(stage)
+        if stats is None:
+            stats = self._stages[stage] = StageStats(len(self.BUCKETS), self.SAMPLE_SIZE)
+        return stats
+
+    def observe(self, stage: str, seconds: float, error: bool = False):
+        """记录一次阶段耗时"""
+        stats = self._stage(stage)
+        stats.count += 1
+        stats.total += seconds
+        stats.samples.append(seconds)
+        if error:
+            stats.errors += 1
+        for idx, bound in enumerate(self.BUCKETS):
+            if seconds <= bound:
+                stats.buckets[idx] += 1
+                break
+
+    def error(self, stage: str):
+        """记录一次阶段错误（未抛出异常的失败，如接口返回非 200）"""
+        self._stage(stage).errors += 1
+
+    def add_bytes(self, kind: str, size: int):
+        """记录传输的字节数"""
+        self._bytes[kind] = self._bytes.get(kind, 0) + size
+
+    @contextmanager
+    def track(self, stage: str):
+        """统计代码块的耗时、并发数和异常"""
+        stats = self._stage(stage)
+        stats.inflight += 1
+        start = time.perf_counter()
+        error = False
+        try:
+            yield
+        except Exception:
+            error = True
+            raise
+        finally:
+            stats.inflight -= 1
+            self.observe(stage, time.perf_counter() - start, error)
+
+    @staticmethod
+    def _percentile(samples: List[float], q: float) -> float:
+        if not samples:
+            return 0.0
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+    def snapshot(self) -> Dict[str, dict]:
+        """各阶段统计快照（分位数基于最近的样本）"""
+        result = {}
+        for stage, stats in self._stages.items():
+            samples = sorted(stats.samples)
+            result[stage] = {
+                "count": stats.count,
+                "errors": stats.errors,
+                "inflight": stats.inflight,
+                "avg": stats.total / stats.count if stats.count else 0.0,
+                "p50": self._percentile(samples, 0.50),
+                "p95": self._percentile(samples, 0.95),
+                "p99": self._percentile(samples, 0.99),
+            }
+        return result
+
+    def summary(self, extra: Optional[Dict[str, dict]] = None) -> str:
+        """生成可读的统计文本"""
+        uptime = time.time() - self.started
+        lines = [f"📊 点歌插件统计（运行 {uptime / 3600:.1f} 小时）"]
+        for stage, stats in sorted(self.snapshot().items()):
+            lines.append(
+                f"{stage}: {stats['count']} 次 ({stats['count'] / uptime * 60:.2f}/分钟), 错误 {stats['errors']}, "
+                f"进行中 {stats['inflight']}, p50/p95/p99 = {stats['p50'] * 1000:.0f}/{stats['p95'] * 1000:.0f}/"
+                f"{stats['p99'] * 1000:.0f} ms"
+            )
+        for kind, size in sorted(self._bytes.items()):
+            lines.append(f"{kind} 流量: {size / (1024 * 1024):.2f} MB")
+        for name, values in (extra or {}).items():
+            lines.append(f"{name}: " + ", ".join(f"{key}={value}" for key, value in values.items()))
+        return "\n".join(lines)
+
+    def prometheus(self, extra: Optional[Dict[str, dict]] = None) -> str:
+        """导出 Prometheus 文本格式"""
+        lines = [
+            "# HELP nekomusic_stage_seconds Latency of each plugin stage.",
+            "# TYPE nekomusic_stage_seconds histogram",
+        ]
+        for stage, stats in sorted(self._stages.items()):
+            cumulative = 0
+            for bound, count in zip(self.BUCKETS, stats.buckets):
+                cumulative += count
+                lines.append(f'nekomusic_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'nekomusic_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {stats.count}')
+            lines.append(f'nekomusic_stage_seconds_sum{{stage="{stage}"}} {stats.total:.6f}')
+            lines.append(f'nekomusic_stage_seconds_count{{stage="{stage}"}} {stats.count}')
+
+        lines += ["# HELP nekomusic_stage_errors_total Failures of each plugin stage.",
+                  "# TYPE nekomusic_stage_errors_total counter"]
+        lines += [f'nekomusic_stage_errors_total{{stage="{stage}"}} {stats.errors}'
+                  for stage, stats in sorted(self._stages.items())]
+
+        lines += ["# HELP nekomusic_stage_inflight Stage executions currently in progress.",
+                  "# TYPE nekomusic_stage_inflight gauge"]
+        lines += [f'nekomusic_stage_inflight{{stage="{stage}"}} {stats.inflight}'
+                  for stage, stats in sorted(self._stages.items())]
+
+        lines += ["# HELP nekomusic_bytes_total Bytes transferred by kind.",
+                  "# TYPE nekomusic_bytes_total counter"]
+        lines += [f'nekomusic_bytes_total{{kind="{kind}"}} {size}' for kind, size in sorted(self._bytes.items())]
+
+        for name, values in (extra or {}).items():
+            for key, value in values.items():
+                if not isinstance(value, (int, float)):
+                    # 只导出数值，状态名等文本只在统计命令中显示
+                    continue
+                metric = f"nekomusic_{name}_{key}"
+                lines.append(f"# TYPE {metric} gauge")
+                lines.append(f"{metric} {float(value)}")
+        return "\n".join(lines) + "\n"
+
+
+class TieredCache:
+    """字节数据两级缓存（内存 LRU + 磁盘），内存和磁盘分别有容量上限，磁盘条目带过期时间
+
+    所有方法都可能读写磁盘，应在线程池中调用。
+    """
+
+    # 日志中的缓存名称与磁盘文件后缀
+    LABEL = "数据"
+    SUFFIX = ".bin"
+
+    def __init__(self, cache_dir: Optional[str], memory_bytes: int, disk_bytes: int, ttl: float):
+        self.cache_dir = cache_dir
+        self.memory_bytes = max(0, int(memory_bytes))
+        self.disk_bytes = max(0, int(disk_bytes))
+        self.ttl = float(ttl)
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_used = 0
+        self._disk_used: Optional[int] = None  # 首次写入磁盘时统计
+        self._lock = threading.Lock()
+
+        # 命中统计
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if self.cache_dir and self.disk_bytes > 0:
+            os.makedirs(self.cache_dir, exist_ok=True)
+        else:
+            self.cache_dir = None
+
+    def _path(self, key: str) -> str:
+        """缓存文件路径"""
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode("utf-8")).hexdigest() + self.SUFFIX)
+
+    def _memory_put(self, key: str, data: bytes):
+        """写入内存 LRU，超出预算时淘汰最久未使用的条目"""
+        if len(data) > self.memory_bytes:
+            return
+        with self._lock:
+            old = self._memory.pop(key, None)
+            if old is not None:
+                self._memory_used -= len(old)
+            self._memory[key] = data
+            self._memory_used += len(data)
+            while self._memory_used > self.memory_bytes:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_used -= len(evicted)
+
+    def _disk_get(self, key: str) -> Optional[bytes]:
+        """从磁盘读取，过期条目视为未命中并删除"""
+        if not self.cache_dir:
+            return None
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                self._disk_remove(path)
+                return None
+            with open(path, "rb") as f:
+                data = f.read()
+            # 刷新访问时间，磁盘淘汰按 atime 近似 LRU
+            os.utime(path, (time.time(), os.path.getmtime(path)))
+            return data
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logger.warning(f"读取{self.LABEL}缓存失败: {str(e)}")
+            return None
+
+    def _disk_remove(self, path: str):
+        """删除磁盘缓存文件"""
+        try:
+            size = os.path.getsize(path)
+            os.unlink(path)
+            with self._lock:
+                if self._disk_used is not None:
+                    self._disk_used -= size
+        except OSError:
+            pass
+
+    def _disk_put(self, key: str, data: bytes):
+        """原子写入磁盘，超出容量时按访问时间淘汰"""
+        if not self.cache_dir or len(data) > self.disk_bytes:
+            return
+        if self._disk_used is None:
+            self._disk_used = sum(entry.stat().st_size for entry in os.scandir(self.cache_dir) if entry.is_file())
+
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            old_size = os.path.getsize(path) if os.path.exists(path) else 0
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"写入{self.LABEL}缓存失败: {str(e)}")
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            return
+
+        with self._lock:
+            self._disk_used += len(data) - old_size
+            over_budget = self._disk_used > self.disk_bytes
+        if over_budget:
+            self._evict_disk()
+
+    def _evict_disk(self):
+        """淘汰磁盘缓存直到低于容量的 90%"""
+        entries = []
+        now = time.time()
+        for entry in os.scandir(self.cache_dir):
+            if not entry.is_file() or entry.name.endswith(".tmp"):
+                continue
+            stat = entry.stat()
+            # 过期条目优先淘汰
+            expired = now - stat.st_mtime > self.ttl
+            entries.append((not expired, stat.st_atime, entry.path))
+        entries.sort()
+
+        target = self.disk_bytes * 0.9
+        for _, _, path in entries:
+            if self._disk_used <= target:
+                break
+            self._disk_remove(path)
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, bytes]:
+        """批量查询缓存，返回命中的 {key: 缩略图数据}"""
+        found = {}
+        for key in keys:
+            with self._lock:
+                data = self._memory.get(key)
+                if data is not None:
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+            if data is None:
+                data = self._disk_get(key)
+                with self._lock:
+                    if data is not None:
+                        self.disk_hits += 1
+                    else:
+                        self.misses += 1
+                if data is not None:
+                    self._memory_put(key, data)
+            if data is not None:
+                found[key] = data
+        return found
+
+    def put_many(self, items: Dict[str, bytes]):
+        """批量写入缓存"""
+        for key, data in items.items():
+            self._memory_put(key, data)
+            self._disk_put(key, data)
+
+    def stats(self) -> dict:
+        """缓存命中统计"""
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_used,
+                "disk_bytes": self._disk_used or 0,
+            }
+
+
+class CoverCache(TieredCache):
+    """封面缩略图缓存，按歌曲 ID 索引
+
+    缓存的是已经缩放好的缩略图，命中后无需重新下载和缩放。
+    """
+
+    LABEL = "封面"
+    SUFFIX = ".jpg"
+
+
+class RenderedImageCache(TieredCache):
+    """搜索结果图片缓存，按结果指纹（歌曲 ID 顺序、页码、平台和输出格式等）索引
+
+    缓存的是编码好的最终图片，命中后直接发送，不需要下载封面和绘制。
+    """
+
+    LABEL = "图片"
+    SUFFIX = ".img"
+
+    @staticmethod
+    def fingerprint(keyword: str, page_data: dict, platform: str, render_options: dict) -> str:
+        """计算搜索结果图片的指纹"""
+        parts = [
+            keyword,
+            platform,
+            repr(sorted(render_options.items())),
+            ",".join(str(song.get("song_id", "")) for song in page_data.get("songs", [])),
+            str(page_data.get("start", 0)),
+            str(page_data.get("page", 0)),
+            str(page_data.get("pages", 1)),
+            str(page_data.get("total", 0)),
+        ]
+        return hashlib.sha1("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+class SongRecord:
+    """精简的歌曲记录，只保留播放和重新绘制所需的字段"""
+
+    __slots__ = ("id", "name", "artist", "album")
+
+    def __init__(self, id, name: str, artist: str, album: str):
+        self.id = id
+        self.name = name
+        self.artist = artist
+        self.album = album
+
+    @classmethod
+    def from_api(cls, song: dict) -> "SongRecord":
+        """从搜索 API 返回的歌曲数据构建"""
+        return cls(
+            song.get("id", ""),
+            str(song.get("name", song.get("title", "未知歌曲"))),
+            str(song.get("artist", song.get("singer", song.get("ar", "未知歌手")))),
+            str(song.get("album", song.get("al", "未知专辑"))),
+        )
+
+    def to_display(self, api_base_url: str = DEFAULT_API_BASE_URL) -> dict:
+        """转换为绘制用的歌曲信息"""
+        # 使用封面 API 获取封面图片
+        cover_url = None
+        if self.id:
+            cover_url = f"{api_base_url}/api/music/cover/{self.id}"
+
+        # 构建歌曲信息文本
+        song_text = f"{self.name}\n"
+        song_text += f"歌手: {self.artist}\n"
+        song_text += f"专辑: {self.album}\n"
+        if self.id:
+            song_text += f"平台音乐ID: {self.id}"
+
+        return {
+            "song_id": self.id,
+            "cover_url": cover_url,
+            "text": song_text
+        }
+
+    def memory_size(self) -> int:
+        """估算占用的内存字节数"""
+        return (sys.getsizeof(self) + sys.getsizeof(self.id) + sys.getsizeof(self.name)
+                + sys.getsizeof(self.artist) + sys.getsizeof(self.album))
+
+
+class SearchSession:
+    """一次搜索保存下来的结果，用于按序号播放和翻页"""
+
+    __slots__ = ("token", "keyword", "songs", "total", "page", "created")
+
+    def __init__(self, token: str, keyword: str, songs: Tuple[SongRecord, ...], total: int):
+        self.token = token
+        self.keyword = keyword
+        self.songs = songs
+        self.total = total
+        self.page = 0
+        self.created = time.monotonic()
+
+    def result_data(self, api_base_url: str = DEFAULT_API_BASE_URL) -> dict:
+        """重建绘制用的搜索结果"""
+        return {"songs": [song.to_display(api_base_url) for song in self.songs], "total": self.total}
+
+    def memory_size(self) -> int:
+        """估算占用的内存字节数"""
+        return (sys.getsizeof(self) + sys.getsizeof(self.token) + sys.getsizeof(self.keyword) + sys.getsizeof(self.songs)
+                + sum(song.memory_size() for song in self.songs))
+
+
+class SearchResultStore:
+    """按结果编号保存搜索结果，条目数超出上限时淘汰最久未使用的结果，超过有效期的结果自动失效"""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max(1, int(max_entries))
+        self.ttl = float(ttl)
+        self._data: "OrderedDict[str, Tuple[SearchSession, int]]" = OrderedDict()
+        self.memory_bytes = 0
+        self.evictions = 0
+
+    def _expired(self, session: SearchSession) -> bool:
+        return time.monotonic() - session.created > self.ttl
+
+    def _remove(self, key: str):
+        _, size = self._data.pop(key)
+        self.memory_bytes -= size
+
+    def get(self, key: str) -> Optional[SearchSession]:
+        """读取搜索结果，已过期返回 None"""
+        item = self._data.get(key)
+        if item is None:
+            return None
+        if self._expired(item[0]):
+            self._remove(key)
+            self.evictions += 1
+            return None
+        self._data.move_to_end(key)
+        return item[0]
+
+    def put(self, key: str, session: SearchSession):
+        """保存搜索结果"""
+        if key in self._data:
+            self._remove(key)
+        size = session.memory_size()
+        self._data[key] = (session, size)
+        self.memory_bytes += size
+
+        # 最久未使用的条目在前，依次淘汰已过期或超出数量上限的条目
+        while self._data:
+            oldest_key, (oldest, _) = next(iter(self._data.items()))
+            if len(self._data) <= self.max_entries and not self._expired(oldest):
+                break
+            self._remove(oldest_key)
+            self.evictions += 1
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key) is not None
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        """存储统计"""
+        return {
+            "sessions": len(self._data),
+            "memory_bytes": self.memory_bytes,
+            "evictions": self.evictions,
+        }
+
+
+class TTLCache:
+    """带过期时间和条目数上限的 LRU 缓存"""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max(0, int(max_entries))
+        self.ttl = float(ttl)
+        self._data: "OrderedDict[str, Tuple[float, object]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str):
+        """读取缓存，未命中或已过期返回 None"""
+        item = self._data.get(key)
+        if item is not None and time.monotonic() - item[0] <= self.ttl:
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+        if item is not None:
+            del self._data[key]
+        self.misses += 1
+        return None
+
+    def put(self, key: str, value):
+        """写入缓存，超出条目数时淘汰最久未使用的条目"""
+        if self.max_entries <= 0 or self.ttl <= 0:
+            return
+        self._data[key] = (time.monotonic(), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SingleFlight:
+    """合并相同 key 的并发调用，只执行一次，结果共享给所有等待者"""
+
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._waiters: Dict[str, int] = {}
+
+    def start(self, key: str, fn) -> asyncio.Task:
+        """启动 fn()（相同 key 的调用正在进行时直接返回该任务），不等待结果"""
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+
+            def _done(t: asyncio.Task):
+                self._inflight.pop(key, None)
+                # 所有等待者都被取消时避免 "exception was never retrieved" 警告
+                if not t.cancelled():
+                    t.exception()
+
+            task.add_done_callback(_done)
+        return task
+
+    async def do(self, key: str, fn):
+        """执行 fn()，若相同 key 的调用正在进行则等待其结果"""
+        task = self.start(key, fn)
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            # shield: 单个等待者被取消不影响其他等待者
+            return await asyncio.shield(task)
+        finally:
+            count = self._waiters.pop(key) - 1
+            if count > 0:
+                self._waiters[key] = count
+
+    def waiters(self, key: str) -> int:
+        """正在等待 key 结果的调用数"""
+        return self._waiters.get(key, 0)
+
+    def cancel_idle(self, key: str) -> bool:
+        """取消没有等待者的调用（如无人使用的后台预取），返回是否取消"""
+        task = self._inflight.get(key)
+        if task is None or self._waiters.get(key):
+            return False
+        task.cancel()
+        return True
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._inflight
+
+
+class UpstreamUnavailableError(Exception):
+    """音乐 API 连续失败，熔断期间直接拒绝请求"""
+
+
+class CircuitBreaker:
+    """熔断器：连续失败达到阈值后打开，冷却期内直接失败；冷却结束后放行一个探测请求，成功则恢复"""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.reset_timeout = float(reset_timeout)
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+        self.rejected = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def check(self) -> bool:
+        """请求前检查，熔断中抛出 UpstreamUnavailableError；返回本次请求是否为半开状态的探测请求"""
+        state = self.state
+        if state == "closed":
+            return False
+        if state == "half_open" and not self._probing:
+            self._probing = True
+            return True
+        self.rejected += 1
+        raise UpstreamUnavailableError("音乐 API 暂时不可用")
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self._probing or self.failures >= self.failure_threshold:
+            if self.opened_at is None or self._probing:
+                logger.warning(f"音乐 API 连续失败 {self.failures} 次，熔断 {self.reset_timeout:.0f}s")
+            self.opened_at = time.monotonic()
+            self._probing = False
+
+    def release_probe(self):
+        """探测请求未得出结果就结束（如被取消）时调用，允许下一个请求重新探测"""
+        self._probing = False
+
+
+class UpstreamClient:
+    """音乐 API 请求层：按观测到的延迟自适应超时、对封面等幂等 GET 发送对冲请求、失败过多时熔断
+
+    每类请求（search/cover/audio）使用独立的熔断器，封面变慢不会导致搜索和播放被熔断；
+    并分别统计最近请求的响应延迟（到收到响应头为止，超时按已等待的时间计入）。
+    样本足够后超时取 p99 × 倍数（限制在下限和默认超时之间），对冲请求在 p95 后发出。
+    """
+
+    # 各类请求的默认超时（样本不足时使用，同时也是自适应超时的上限）和下限(秒)
+    DEFAULT_TIMEOUTS = {"search": 10.0, "cover": 8.0, "audio": 30.0}
+    MIN_TIMEOUTS = {"search": 2.0, "cover": 1.0, "audio": 5.0}
+    # 计算分位数所需的最少样本数与保留的样本数
+    MIN_SAMPLES = 20
+    SAMPLE_SIZE = 200
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30, timeout_multiplier: float = 3.0,
+                 hedge: bool = True, metrics: Optional[Metrics] = None):
+        self.breakers = {kind: CircuitBreaker(failure_threshold, reset_timeout) for kind in self.DEFAULT_TIMEOUTS}
+        self.timeout_multiplier = max(1.0, float(timeout_multiplier))
+        self.hedge = hedge
+        self.metrics = metrics or Metrics()
+        self._latencies: Dict[str, deque] = {kind: deque(maxlen=self.SAMPLE_SIZE) for kind in self.DEFAULT_TIMEOUTS}
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def _percentile(self, kind: str, q: float) -> Optional[float]:
+        samples = self._latencies[kind]
+        if len(samples) < self.MIN_SAMPLES:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def timeout(self, kind: str) -> float:
+        """当前的自适应超时(秒)；熔断器未关闭（探测请求）时使用默认超时，避免过紧的超时导致无法恢复"""
+        default = self.DEFAULT_TIMEOUTS[kind]
+        if self.breakers[kind].state != "closed":
+            return default
+        p99 = self._percentile(kind, 0.99)
+        if p99 is None:
+            return default
+        return min(default, max(self.MIN_TIMEOUTS[kind], p99 * self.timeout_multiplier))
+
+    def hedge_delay(self, kind: str) -> Optional[float]:
+        """发出对冲请求前等待的时间(秒)，样本不足或未开启时返回 None"""
+        if not self.hedge:
+            return None
+        p95 = self._percentile(kind, 0.95)
+        return max(0.05, p95) if p95 is not None else None
+
+    @asynccontextmanager
+    async def request(self, session, method: str, kind: str, url: str, timeout=None,
+                      record_failure: bool = True, **kwargs):
+        """发送请求并记录延迟和结果，熔断期间直接抛出 UpstreamUnavailableError
+
+        5xx、超时和连接错误计为失败；其余状态码说明 API 可用，计为成功。
+        record_failure 为 False 时失败不计入熔断器，由调用方自行记录（如对冲请求只计一次）。
+        """
+        breaker = self.breakers[kind]
+        probe = breaker.check()
+        recorded = False
+        if timeout is None:
+            timeout = aiohttp.ClientTimeout(total=self.timeout(kind))
+        start = time.perf_counter()
+        try:
+            async with session.request(method, url, timeout=timeout, **kwargs) as response:
+                if response.status >= 500:
+                    if record_failure:
+                        breaker.record_failure()
+                        recorded = True
+                    self.metrics.error(f"upstream_{kind}")
+                else:
+                    latency = time.perf_counter() - start
+                    self._latencies[kind].append(latency)
+                    self.metrics.observe(f"upstream_{kind}", latency)
+                    breaker.record_success()
+                    recorded = True
+                yield response
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            if isinstance(e, asyncio.TimeoutError) and not recorded:
+                # 等待响应超时也计入延迟样本（取已等待的时间），上游变慢后超时随 p99 放宽，而不是一直超时没有新样本
+                self._latencies[kind].append(time.perf_counter() - start)
+            if record_failure:
+                breaker.record_failure()
+                recorded = True
+            self.metrics.error(f"upstream_{kind}")
+            raise
+        finally:
+            # 探测请求被取消或失败交由调用方记录时，释放探测名额，否则熔断器会一直停留在半开状态
+            if probe and not recorded:
+                breaker.release_probe()
+
+    async def _get_bytes(self, session, kind: str, url: str) -> Tuple[int, Optional[bytes]]:
+        async with self.request(session, "GET", kind, url, record_failure=False) as response:
+            if response.status != 200:
+                return response.status, None
+            return response.status, await response.read()
+
+    async def get_bytes(self, session, kind: str, url: str) -> Tuple[int, Optional[bytes]]:
+        """幂等 GET，返回 (状态码, 内容)；首个请求超过 p95 仍未完成时再发一个对冲请求，取先成功的结果
+
+        首个请求和对冲请求都失败时只向熔断器记录一次失败。
+        """
+        breaker = self.breakers[kind]
+        first = asyncio.create_task(self._get_bytes(session, kind, url))
+        tasks = {first}
+        delay = self.hedge_delay(kind)
+        try:
+            if delay is not None:
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+                if not done and breaker.state == "closed":
+                    self.hedges += 1
+                    tasks.add(asyncio.create_task(self._get_bytes(session, kind, url)))
+
+            error: Optional[BaseException] = None
+            server_error: Optional[Tuple[int, Optional[bytes]]] = None
+            failed = False
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    exception = task.exception()
+                    if exception is None:
+                        if task.result()[0] < 500:
+                            if task is not first:
+                                self.hedge_wins += 1
+                            return task.result()
+                        server_error = task.result()
+                        failed = True
+                    else:
+                        error = exception
+                        failed = failed or isinstance(exception, (aiohttp.ClientError, asyncio.TimeoutError))
+            if failed:
+                breaker.record_failure()
+            if server_error is not None:
+                return server_error
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def stats(self) -> dict:
+        result = {f"{kind}_timeout": round(self.timeout(kind), 3) for kind in self.DEFAULT_TIMEOUTS}
+        for kind, breaker in self.breakers.items():
+            result[f"{kind}_breaker_open"] = int(breaker.state != "closed")
+            result[f"{kind}_breaker_rejected"] = breaker.rejected
+        result.update({
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+        })
+        return result
+
+
+class AudioTooLargeError(Exception):
+    """音频文件超过大小上限"""
+
+    def __init__(self, size: int, limit: int):
+        super().__init__(f"音频文件过大: {size} > {limit} bytes")
+        self.size = size
+        self.limit = limit
+
+
+class AudioDownloadError(Exception):
+    """音频下载接口返回非 200 状态码"""
+
+    def __init__(self, status: int, body: str = ""):
+        super().__init__(f"音频下载失败,状态码: {status}")
+        self.status = status
+        self.body = body
+
+
+class AudioDownloader:
+    """音频流式下载器：分块写入磁盘，限制单个文件大小和全局在途字节数"""
+
+    CHUNK_SIZE = 256 * 1024
+
+    def __init__(self, max_file_bytes: int, inflight_budget: int, timeout: float = 60,
+                 metrics: Optional[Metrics] = None, upstream: Optional[UpstreamClient] = None):
+        self.metrics = metrics or Metrics()
+        self.upstream = upstream or UpstreamClient(metrics=self.metrics)
+        self.max_file_bytes = max(1, int(max_file_bytes))
+        self.inflight_budget = max(self.max_file_bytes, int(inflight_budget))
+        self.timeout = timeout
+        self.inflight_bytes = 0
+        self._budget_cond: Optional[asyncio.Condition] = None
+
+    async def _acquire(self, size: int):
+        """预留在途字节额度，额度不足时等待其他下载完成"""
+        if self._budget_cond is None:
+            self._budget_cond = asyncio.Condition()
+        async with self._budget_cond:
+            await self._budget_cond.wait_for(lambda: self.inflight_bytes + size <= self.inflight_budget)
+            self.inflight_bytes += size
+
+    async def _release(self, size: int):
+        """归还在途字节额度"""
+        async with self._budget_cond:
+            self.inflight_bytes -= size
+            self._budget_cond.notify_all()
+
+    async def download(self, session, url: str, path: str, max_bytes: Optional[int] = None) -> int:
+        """下载音频到 path，返回文件大小
+
+        Content-Length 超过上限时不下载任何数据直接抛出 AudioTooLargeError；
+        未提供 Content-Length 时边下载边检查。
+        """
+        limit = min(self.max_file_bytes, max_bytes) if max_bytes else self.max_file_bytes
+        with self.metrics.track("audio_download"):
+            return await self._download(session, url, path, limit)
+
+    async def _download(self, session, url: str, path: str, limit: int) -> int:
+        # 总时长取决于文件大小，保持固定上限；等待响应和两次读取之间的间隔使用自适应超时
+        timeout = aiohttp.ClientTimeout(total=self.timeout, sock_read=self.upstream.timeout("audio"))
+        async with self.upstream.request(session, "GET", "audio", url, timeout=timeout) as response:
+            logger.info(f"音频响应状态码: {response.status}")
+            if response.status != 200:
+                raise AudioDownloadError(response.status, await response.text())
+
+            length = response.content_length
+            if length is not None and length > limit:
+                raise AudioTooLargeError(length, limit)
+
+            reserved = length if length is not None else limit
+            await self._acquire(reserved)
+            try:
+                written = 0
+                # 分块直接写入文件，内存中最多只保留一个块
+                with open(path, "wb") as f:
+                    async for chunk in response.content.iter_chunked(self.CHUNK_SIZE):
+                        written += len(chunk)
+                        if written > limit:
+                            raise AudioTooLargeError(written, limit)
+                        f.write(chunk)
+                self.metrics.add_bytes("audio", written)
+                return written
+            finally:
+                await self._release(reserved)
+
+
+class AudioCache:
+    """磁盘音频缓存：按歌曲 ID 存储，总容量超出预算时按最近使用时间淘汰
+
+    写入先落到临时文件再原子重命名；相同歌曲的并发请求只下载一次。
+    正在发送中的文件会被固定（acquire/release），不会被淘汰。
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int, downloader: AudioDownloader, suffix: str = ".mp3"):
+        self.cache_dir = cache_dir
+        self.max_bytes = max(0, int(max_bytes))
+        self.downloader = downloader
+        self.suffix = suffix
+        self._index: "OrderedDict[str, int]" = OrderedDict()  # 文件路径 -> 大小，按最近使用排序
+        self._used = 0
+        self._loaded = False
+        self._loading: Optional[asyncio.Future] = None
+        self._pinned: Dict[str, int] = {}
+        self._flight = SingleFlight()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        self.hits = 0
+        self.misses = 0
+        self.joins = 0
+
+    def _path(self, song_id, suffix: Optional[str] = None) -> str:
+        """缓存文件路径"""
+        name = hashlib.sha1(str(song_id).encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, name + (suffix or self.suffix))
+
+    def _load_index(self):
+        """扫描缓存目录建立索引（阻塞，首次使用时在线程中执行）"""
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if not entry.is_file():
+                continue
+            if entry.name.endswith(".tmp"):
+                # 上次进程退出时残留的未完成下载
+                try:
+                    os.unlink(entry.path)
+                except OSError:
+                    pass
+                continue
+            stat = entry.stat()
+            entries.append((stat.st_atime, entry.path, stat.st_size))
+        for _, path, size in sorted(entries):
+            self._index[path] = size
+            self._used += size
+
+    async def _ensure_loaded(self):
+        if self._loaded:
+            return
+        # 并发的首次调用共用同一次扫描，避免重复累计容量
+        if self._loading is None:
+            self._loading = asyncio.ensure_future(asyncio.to_thread(self._load_index))
+        await asyncio.shield(self._loading)
+        self._loaded = True
+
+    async def acquire(self, session, song_id, url: str, max_bytes: Optional[int] = None) -> str:
+        """获取歌曲的缓存文件路径（未缓存时下载），使用完毕后必须调用 release"""
+        return await self.acquire_with(
+            song_id,
+            lambda tmp_path: self.downloader.download(session, url, tmp_path, max_bytes=max_bytes),
+            flight_key=f"{song_id}:{max_bytes}",
+            max_bytes=max_bytes,
+        )
+
+    async def acquire_with(self, key, produce: Callable[[str], Awaitable[int]], flight_key: Optional[str] = None,
+                           max_bytes: Optional[int] = None, suffix: Optional[str] = None) -> str:
+        """获取 key 对应的缓存文件路径，未缓存时调用 produce(临时文件路径) 生成文件并返回其大小
+
+        相同 flight_key 的并发请求只生成一次；使用完毕后必须调用 release。
+        """
+        await self._ensure_loaded()
+        path = self._path(key, suffix)
+
+        size = self._index.get(path)
+        if size is not None and os.path.exists(path):
+            self.hits += 1
+            self._index.move_to_end(path)
+            os.utime(path)
+            self._pin(path)
+        else:
+            flight_key = flight_key or path
+            if flight_key in self._flight:
+                # 加入正在进行的下载（如后台预取）
+                self.joins += 1
+            else:
+                self.misses += 1
+            task = self._flight.start(flight_key, lambda: self._produce(path, produce, flight_key))
+            try:
+                # _produce 完成时已为每个等待者固定文件，避免恢复执行前被其他请求的 release 淘汰
+                size = await self._flight.do(flight_key, lambda: task)
+            except asyncio.CancelledError:
+                if task.done() and not task.cancelled() and task.exception() is None:
+                    # 文件已生成但本请求在恢复前被取消，归还代为固定的名额
+                    self._unpin(path)
+                raise
+
+        if max_bytes and size > max_bytes:
+            self._unpin(path)
+            raise AudioTooLargeError(size, max_bytes)
+        return path
+
+    async def prefetch(self, session, song_id, url: str, max_bytes: Optional[int] = None) -> Optional[asyncio.Task]:
+        """在后台开始下载歌曲（不固定文件），已缓存或正在下载时返回 None
+
+        之后以相同 max_bytes 调用 acquire 会直接命中缓存或加入这次下载。
+        """
+        await self._ensure_loaded()
+        path = self._path(song_id)
+        key = f"{song_id}:{max_bytes}"
+        if path in self._index or key in self._flight:
+            return None
+        return self._flight.start(key, lambda: self._produce(
+            path, lambda tmp_path: self.downloader.download(session, url, tmp_path, max_bytes=max_bytes), key))
+
+    def cached(self, song_id) -> bool:
+        """歌曲是否已在磁盘缓存中"""
+        return self._path(song_id) in self._index
+
+    def cancel_prefetch(self, song_id, max_bytes: Optional[int] = None) -> bool:
+        """取消没有播放请求在等待的后台下载"""
+        return self._flight.cancel_idle(f"{song_id}:{max_bytes}")
+
+    async def _produce(self, path: str, produce: Callable[[str], Awaitable[int]], flight_key: str) -> int:
+        """生成到临时文件后原子重命名为缓存文件，并为 flight_key 的每个等待者固定文件"""
+        tmp_path = f"{path}.{os.getpid()}.{id(asyncio.current_task())}.tmp"
+        try:
+            size = await produce(tmp_path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
+        self._used += size - self._index.pop(path, 0)
+        self._index[path] = size
+        waiters = self._flight.waiters(flight_key)
+        if waiters:
+            self._pinned[path] = self._pinned.get(path, 0) + waiters
+        return size
+
+    def size(self, path: str) -> int:
+        """缓存文件大小，未缓存时为 0"""
+        return self._index.get(path, 0)
+
+    def _pin(self, path: str):
+        self._pinned[path] = self._pinned.get(path, 0) + 1
+
+    def _unpin(self, path: str):
+        count = self._pinned.get(path, 0) - 1
+        if count > 0:
+            self._pinned[path] = count
+        else:
+            self._pinned.pop(path, None)
+
+    async def release(self, path: str):
+        """取消固定，并在超出容量时淘汰最久未使用的文件"""
+        self._unpin(path)
+
+        if self._used <= self.max_bytes:
+            return
+        evicted = []
+        for candidate, size in list(self._index.items()):
+            if self._used <= self.max_bytes:
+                break
+            if candidate in self._pinned:
+                continue
+            del self._index[candidate]
+            self._used -= size
+            evicted.append(candidate)
+        if evicted:
+            await asyncio.to_thread(self._remove_files, evicted)
+
+    @staticmethod
+    def _remove_files(paths: List[str]):
+        """删除被淘汰的缓存文件"""
+        for path in paths:
+            try:
+                os.unlink(path)
+            except OSError as e:
+                logger.warning(f"删除音频缓存失败: {str(e)}")
+
+    def stats(self) -> dict:
+        """缓存统计"""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "joins": self.joins,
+            "files": len(self._index),
+            "bytes": self._used,
+        }
+
+
+class AudioPrefetcher:
+    """搜索结果展示后在后台预取前几首歌曲的音频
+
+    用户回复序号时 play_music 直接命中缓存或加入正在进行的下载。预取受并发数限制，
+    且只在音频下载的在途字节数低于预算时进行，不挤占正常播放；用户选歌后不再启动
+    该结果的其余预取，结果过期时取消仍在下载且无人等待的预取。
+    """
+
+    def __init__(self, audio_cache: AudioCache, count: int, concurrency: int, budget_bytes: int, ttl: float):
+        self.audio_cache = audio_cache
+        self.count = max(0, int(count))
+        self.concurrency = max(1, int(concurrency))
+        self.budget_bytes = max(0, int(budget_bytes))
+        self.ttl = float(ttl)
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._jobs: Dict[str, asyncio.Task] = {}  # 结果编号 -> 预取任务
+        self._claimed: set = set()  # 用户已选歌的结果编号
+
+        self.started = 0
+        self.completed = 0
+        self.failed = 0
+        self.skipped = 0
+        self.cancelled = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.count > 0
+
+    def schedule(self, token: str, session, items: List[Tuple[object, str]], max_bytes: Optional[int]):
+        """为一次搜索结果安排预取，items 为按顺序排列的 (歌曲 ID, 音频 URL)"""
+        if not self.enabled or not items:
+            return
+        task = asyncio.create_task(self._run(token, session, items[:self.count], max_bytes))
+        self._jobs[token] = task
+        task.add_done_callback(lambda _: self._finish(token))
+
+    def claim(self, token: str):
+        """用户已从该结果中选歌，不再启动其余预取"""
+        if token in self._jobs:
+            self._claimed.add(token)
+
+    def _finish(self, token: str):
+        self._jobs.pop(token, None)
+        self._claimed.discard(token)
+
+    async def _run(self, token: str, session, items: List[Tuple[object, str]], max_bytes: Optional[int]):
+        """依次预取，结果过期时取消仍无人等待的下载"""
+        started = []
+        try:
+            await asyncio.wait_for(self._prefetch_all(token, session, items, max_bytes, started), self.ttl)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            for song_id in started:
+                if self.audio_cache.cancel_prefetch(song_id, max_bytes):
+                    self.cancelled += 1
+
+    async def _prefetch_all(self, token: str, session, items, max_bytes: Optional[int], started: list):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        await asyncio.gather(*(self._prefetch_one(token, session, song_id, url, max_bytes, started)
+                               for song_id, url in items))
+
+    async def _prefetch_one(self, token: str, session, song_id, url: str, max_bytes: Optional[int], started: list):
+        async with self._semaphore:
+            if token in self._claimed:
+                return
+            if self.audio_cache.downloader.inflight_bytes >= self.budget_bytes:
+                self.skipped += 1
+                return
+            task = await self.audio_cache.prefetch(session, song_id, url, max_bytes)
+            if task is None:
+                return
+            self.started += 1
+            started.append(song_id)
+            try:
+                await asyncio.shield(task)
+                self.completed += 1
+            except asyncio.CancelledError:
+                if not task.cancelled():
+                    raise
+            except Exception as e:
+                self.failed += 1
+                logger.info(f"预取音频失败: {song_id}, {str(e)}")
+            started.remove(song_id)
+
+    def close(self):
+        """取消全部预取"""
+        for task in list(self._jobs.values()):
+            task.cancel()
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._jobs),
+            "started": self.started,
+            "completed": self.completed,
+            "failed": self.failed,
+            "skipped": self.skipped,
+            "cancelled": self.cancelled,
+        }
+
+
+class TranscodeError(Exception):
+    """ffmpeg 转码失败或超时"""
+
+
+class AudioTranscoder:
+    """可选的音频转码: 通过本地 ffmpeg 子进程将源音频转为平台适合的紧凑格式
+
+    转码结果按 (歌曲 ID, 目标格式和码率) 存入磁盘缓存，每首歌曲每种格式只转码一次；
+    ffmpeg 在独立进程中运行，同时运行的进程数受限，不占用事件循环。
+    """
+
+    # 格式名: (文件后缀, ffmpeg 输出参数)，{bitrate} 替换为配置的码率(kbps)
+    PROFILES = {
+        # Telegram 语音消息要求 OGG 封装的 Opus
+        "opus": (".ogg", ("-vn", "-map_metadata", "-1", "-c:a", "libopus", "-b:a", "{bitrate}k",
+                          "-vbr", "on", "-application", "audio", "-f", "ogg")),
+        "mp3": (".mp3", ("-vn", "-map_metadata", "-1", "-c:a", "libmp3lame", "-b:a", "{bitrate}k", "-f", "mp3")),
+        # AMR-NB 只支持 8kHz 单声道，体积最小但音质较差
+        "amr": (".amr", ("-vn", "-map_metadata", "-1", "-ac", "1", "-ar", "8000",
+                         "-c:a", "libopencore_amrnb", "-b:a", "12.2k", "-f", "amr")),
+    }
+    DEFAULT_BITRATES = {"opus": 64, "mp3": 128, "amr": 12}
+
+    def __init__(self, cache: AudioCache, ffmpeg_path: str = "", concurrency: int = 2, timeout: float = 120,
+                 bitrates: Optional[Dict[str, int]] = None, metrics: Optional[Metrics] = None):
+        self.cache = cache
+        self.ffmpeg = ffmpeg_path or shutil.which("ffmpeg") or ""
+        self.concurrency = max(1, int(concurrency))
+        self.timeout = timeout
+        self.bitrates = dict(self.DEFAULT_BITRATES)
+        self.bitrates.update({name: int(value) for name, value in (bitrates or {}).items() if value})
+        self.metrics = metrics or Metrics()
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+        self.transcoded = 0
+        self.failures = 0
+        self.input_bytes = 0
+        self.output_bytes = 0
+        self.sent = 0
+        self.sent_bytes = 0
+        self.original_bytes = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.ffmpeg)
+
+    def _cache_key(self, song_id, profile: str) -> str:
+        return f"{song_id}@{profile}-{self.bitrates[profile]}k"
+
+    async def transcode(self, song_id, source_path: str, profile: str, max_bytes: Optional[int] = None) -> str:
+        """返回转码后的缓存文件路径（已固定，使用完毕后调用 cache.release）
+
+        转码结果超过 max_bytes 时抛出 AudioTooLargeError。
+        """
+        suffix, _ = self.PROFILES[profile]
+        return await self.cache.acquire_with(
+            self._cache_key(song_id, profile),
+            lambda tmp_path: self._run(source_path, tmp_path, profile),
+            max_bytes=max_bytes,
+            suffix=suffix,
+        )
+
+    async def _run(self, source_path: str, target_path: str, profile: str) -> int:
+        """运行 ffmpeg 将 source_path 转码到 target_path，返回输出文件大小"""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        _, output_args = self.PROFILES[profile]
+        args = [arg.format(bitrate=self.bitrates[profile]) for arg in output_args]
+
+        async with self._semaphore:
+            with self.metrics.track("audio_transcode"):
+                process = await asyncio.create_subprocess_exec(
+                    self.ffmpeg, "-nostdin", "-hide_banner", "-loglevel", "error", "-y",
+                    "-i", source_path, *args, target_path,
+                    stdin=asyncio.subprocess.DEVNULL,
+                    stdout=asyncio.subprocess.DEVNULL,
+                    stderr=asyncio.subprocess.PIPE,
+                )
+                try:
+                    _, stderr = await asyncio.wait_for(process.communicate(), self.timeout)
+                except BaseException as e:
+                    # 超时或请求被取消时结束 ffmpeg 进程
+                    with contextlib.suppress(ProcessLookupError):
+                        process.kill()
+                    await process.wait()
+                    if isinstance(e, asyncio.TimeoutError):
+                        self.failures += 1
+                        raise TranscodeError(f"转码超时({self.timeout:.0f}s)") from None
+                    raise
+                if process.returncode != 0:
+                    self.failures += 1
+                    detail = stderr.decode("utf-8", errors="replace").strip()[-300:]
+                    raise TranscodeError(f"ffmpeg 退出码 {process.returncode}: {detail}")
+
+        size = os.path.getsize(target_path)
+        self.transcoded += 1
+        self.input_bytes += os.path.getsize(source_path)
+        self.output_bytes += size
+        return size
+
+    def record_send(self, original_size: int, sent_size: int):
+        """记录一次发送的文件大小和未转码时需要上传的大小"""
+        self.sent += 1
+        self.sent_bytes += sent_size
+        self.original_bytes += original_size
+        self.metrics.add_bytes("audio_upload", sent_size)
+
+    def stats(self) -> dict:
+        """转码统计，saved_bytes 为转码后累计少上传的字节数"""
+        return {
+            "enabled": self.enabled,
+            "transcoded": self.transcoded,
+            "failures": self.failures,
+            "input_bytes": self.input_bytes,
+            "output_bytes": self.output_bytes,
+            "sent": self.sent,
+            "sent_bytes": self.sent_bytes,
+            "saved_bytes": self.original_bytes - self.sent_bytes,
+            **{f"cache_{key}": value for key, value in self.cache.stats().items()},
+        }
+
+
+class AdmissionRejectedError(Exception):
+    """调度队列已满，拒绝新的任务"""
+
+    def __init__(self, pool: str, queued: int, scope: str = ""):
+        super().__init__(f"{pool} {scope}队列已满({queued})")
+        self.pool = pool
+
+
+class _Waiter:
+    """排队中的任务"""
+
+    __slots__ = ("priority", "seq", "pool", "session_id", "user_id", "future")
+
+    def __init__(self, priority: int, seq: int, pool: str, session_id: str, user_id: str, future: asyncio.Future):
+        self.priority = priority
+        self.seq = seq
+        self.pool = pool
+        self.session_id = session_id
+        self.user_id = user_id
+        self.future = future
+
+
+class AdmissionScheduler:
+    """搜索、渲染和音频任务的准入调度
+
+    每类任务有独立的并发上限和排队上限，所有任务再共享一个总并发上限；有空位时按优先级
+    （搜索 > 渲染 > 音频）和到达顺序放行。同一会话、同一用户在每类任务中的并发数也有上限，
+    超出的请求继续排队，不会占满某一类任务的全部名额；每个会话、每个用户的排队数也分别有上限，
+    超出时只拒绝该会话或用户的请求，不会占满整个队列导致其他用户被拒绝。
+    """
+
+    PRIORITIES = {"search": 0, "render": 1, "audio": 2}
+
+    def __init__(self, limits: Dict[str, int], total_limit: int, queue_limit: int,
+                 per_session_limit: int, per_user_limit: int, per_session_queue_limit: int = 8,
+                 per_user_queue_limit: int = 4, metrics: Optional[Metrics] = None):
+        self.limits = {pool: max(1, int(limits.get(pool, 1))) for pool in self.PRIORITIES}
+        self.total_limit = max(1, int(total_limit))
+        self.queue_limit = max(0, int(queue_limit))
+        self.per_session_limit = max(1, int(per_session_limit))
+        self.per_user_limit = max(1, int(per_user_limit))
+        self.per_session_queue_limit = max(0, int(per_session_queue_limit))
+        self.per_user_queue_limit = max(0, int(per_user_queue_limit))
+        self.metrics = metrics or Metrics()
+
+        self._waiting: List[_Waiter] = []
+        self._seq = 0
+        self._running: Dict[str, int] = {pool: 0 for pool in self.PRIORITIES}
+        self._total_running = 0
+        self._by_session: Dict[Tuple[str, str], int] = {}
+        self._by_user: Dict[Tuple[str, str], int] = {}
+        self.rejected: Dict[str, int] = {pool: 0 for pool in self.PRIORITIES}
+
+    @asynccontextmanager
+    async def slot(self, pool: str, session_id: str = "", user_id: str = ""):
+        """排队获取 pool 的执行名额，退出时释放"""
+        waiter = await self._acquire(pool, str(session_id), str(user_id))
+        try:
+            yield
+        finally:
+            self._release(waiter)
+
+    def _queued(self, pool: str) -> int:
+        return sum(1 for waiter in self._waiting if waiter.pool == pool)
+
+    def _check_queue(self, waiter: _Waiter):
+        """检查排队上限: 先检查发起者所在会话和用户的排队数，再检查整个队列"""
+        pool = waiter.pool
+        queued_session = sum(1 for w in self._waiting if w.pool == pool and w.session_id == waiter.session_id)
+        queued_user = sum(1 for w in self._waiting if w.pool == pool and w.user_id == waiter.user_id)
+        queued = self._queued(pool)
+        for limit, count, scope in ((self.per_session_queue_limit, queued_session, "会话"),
+                                    (self.per_user_queue_limit, queued_user, "用户"),
+                                    (self.queue_limit, queued, "")):
+            if limit and count >= limit:
+                self.rejected[pool] += 1
+                raise AdmissionRejectedError(pool, count, scope)
+
+    async def _acquire(self, pool: str, session_id: str, user_id: str) -> _Waiter:
+        self._seq += 1
+        waiter = _Waiter(self.PRIORITIES[pool], self._seq, pool, session_id, user_id,
+                         asyncio.get_running_loop().create_future())
+        if self._runnable(waiter):
+            # 有空位时直接放行：此时仍在排队的任务都受并发上限限制，不会被插队
+            self._adjust(waiter, 1)
+            self.metrics.observe(f"wait_{pool}", 0.0)
+            return waiter
+
+        self._check_queue(waiter)
+        self._waiting.append(waiter)
+        self._dispatch()
+
+        start = time.perf_counter()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # 已获得名额但调用方被取消
+                self._release(waiter)
+            else:
+                self._waiting.remove(waiter)
+                self._dispatch()
+            raise
+        self.metrics.observe(f"wait_{pool}", time.perf_counter() - start)
+        return waiter
+
+    def _runnable(self, waiter: _Waiter) -> bool:
+        return (self._total_running < self.total_limit
+                and self._running[waiter.pool] < self.limits[waiter.pool]
+                and self._by_session.get((waiter.pool, waiter.session_id), 0) < self.per_session_limit
+                and self._by_user.get((waiter.pool, waiter.user_id), 0) < self.per_user_limit)
+
+    def _dispatch(self):
+        """按优先级和到达顺序放行可以执行的任务"""
+        for waiter in sorted(self._waiting, key=lambda w: (w.priority, w.seq)):
+            if self._total_running >= self.total_limit:
+                break
+            if waiter.future.done() or not self._runnable(waiter):
+                continue
+            self._waiting.remove(waiter)
+            self._adjust(waiter, 1)
+            waiter.future.set_result(None)
+
+    def _adjust(self, waiter: _Waiter, delta: int):
+        self._running[waiter.pool] += delta
+        self._total_running += delta
+        for counts, key in ((self._by_session, (waiter.pool, waiter.session_id)),
+                            (self._by_user, (waiter.pool, waiter.user_id))):
+            count = counts.get(key, 0) + delta
+            if count > 0:
+                counts[key] = count
+            else:
+                counts.pop(key, None)
+
+    def _release(self, waiter: _Waiter):
+        self._adjust(waiter, -1)
+        self._dispatch()
+
+    def stats(self) -> dict:
+        result = {}
+        for pool in self.PRIORITIES:
+            result[f"{pool}_running"] = self._running[pool]
+            result[f"{pool}_queued"] = self._queued(pool)
+            result[f"{pool}_rejected"] = self.rejected[pool]
+        return result
+
+
+# 进程内共享的字体缓存: (路径, 字号, 索引) -> 字体，首次绘制时才解析字体文件
+_font_cache: Dict[Tuple[str, int, int], ImageFont.ImageFont] = {}
+_font_failed_paths: set = set()
+_font_lock = threading.Lock()
+
+
+def load_font(paths: Tuple[str, ...], size: int, index: int = 0) -> ImageFont.ImageFont:
+    """按顺序尝试加载字体（每个进程对同一字体只解析一次），全部失败时使用默认字体"""
+    for path in paths + ("",):
+        font = _font_cache.get((path, size, index))
+        if font is not None:
+            return font
+
+    with _font_lock:
+        for path in paths:
+            key = (path, size, index)
+            if key in _font_cache:
+                return _font_cache[key]
+            if path in _font_failed_paths:
+                continue
+            try:
+                font = ImageFont.truetype(path, size, index=index)
+            except Exception as e:
+                # 字体文件不存在或损坏时不再重试该文件
+                logger.warning(f"加载字体失败 {path}: {str(e)}")
+                _font_failed_paths.add(path)
+                continue
+            _font_cache[key] = font
+            return font
+
+        key = ("", size, index)
+        if key not in _font_cache:
+            if not any(cached[0] == "" for cached in _font_cache):
+                logger.warning("所有自定义字体加载失败，使用默认字体（中文可能无法正常显示）")
+            _font_cache[key] = ImageFont.load_default()
+        return _font_cache[key]
+
+
+@functools.lru_cache(maxsize=64)
+def measure_text(text: str, paths: Tuple[str, ...], size: int) -> Tuple[int, int, int, int]:
+    """测量固定文本（标题、页脚等）的边界框，结果按文本和字号缓存"""
+    return load_font(paths, size).getbbox(text)
+
+
+class RenderQueueFullError(Exception):
+    """渲染任务排队数超过上限"""
+
+
 class MusicSearchDrawer:
     """音乐搜索结果图片绘制器"""
 
     # 常量定义
-    FONT_PATHS = [
+    FONT_PATHS = (
         FONT_PATH_REGULAR := os.path.join(os.path.dirname(__file__), "DreamHanSans-W17.ttc"),
-        FONT_PATH_BOLD := FONT_PATH_REGULAR,
-    ]
+    )
+    FONT_PATH_BOLD = FONT_PATH_REGULAR
+
+    # 字号
+    FONT_SIZE_TITLE = 36
+    FONT_SIZE_SUBTITLE = 18
+    FONT_SIZE_SONG_NAME = 22
+    FONT_SIZE_SONG_INFO = 16
+    FONT_SIZE_FOOTER = 12
+
+    # 页脚文本（两行，居中）
+    FOOTER_LINES = (
+        ("Neko云音乐 - Powered by 不穿胖次の小奶猫", 8),
+        ("music.cnmsb.xin 蜀ICP备2025177767号-1", 26),
+    )
 
     # 颜色定义
     COLOR_BG_START = (248, 250, 255)
@@ -31,6 +1538,7 @@ class MusicSearchDrawer:
     COLOR_CARD_OUTLINE = (220, 225, 235)
     COLOR_ACCENT = (0, 90, 180)
     COLOR_FOOTER = (100, 100, 100)
+    COLOR_COVER_PLACEHOLDER = (225, 232, 245)
 
     # 布局尺寸
     # Telegram 图片限制: 宽度最大 1280px, 高度最大 2560px, 大小最大 10MB
@@ -40,91 +1548,93 @@ class MusicSearchDrawer:
     HEADER_HEIGHT = 90  # 从 100 调整为 90
     ITEM_HEIGHT = 110   # 从 120 调整为 110
     FOOTER_HEIGHT = 60
-
-    def __init__(self):
-        self._load_fonts()
-
-    def _load_fonts(self):
-        """加载字体"""
-        import os
-        try:
-            loaded = False
-            for font_path in self.FONT_PATHS:
-                # 检查文件是否存在
-                if not os.path.exists(font_path):
-                    logger.warning(f"字体文件不存在: {font_path}")
-                    continue
-
-                # 检查文件是否可读
-                if not os.access(font_path, os.R_OK):
-                    logger.warning(f"字体文件不可读: {font_path}")
-                    continue
-
-                logger.info(f"字体文件存在且可读: {font_path}")
-
-                try:
-                    logger.info(f"尝试加载字体: {font_path}")
-
-                    # 尝试多种加载方式
-                    # 方式1: 指定索引加载 TTC 字体
-                    try:
-                        self.font_title = ImageFont.truetype(font_path, 36, index=0)
-                        self.font_subtitle = ImageFont.truetype(font_path, 18, index=0)
-                        self.font_song_name = ImageFont.truetype(font_path, 22, index=0)
-                        self.font_song_info = ImageFont.truetype(font_path, 16, index=0)
-                        self.font_footer = ImageFont.truetype(font_path, 12, index=0)
-                        logger.info(f"成功加载字体（方式1）: {font_path}")
-                        loaded = True
-                        break
-                    except Exception as e1:
-                        logger.warning(f"方式1加载失败 {font_path}: {str(e1)}")
-                        pass
-
-                    # 方式2: 不指定索引
-                    try:
-                        self.font_title = ImageFont.truetype(font_path, 36)
-                        self.font_subtitle = ImageFont.truetype(font_path, 18)
-                        self.font_song_name = ImageFont.truetype(font_path, 22)
-                        self.font_song_info = ImageFont.truetype(font_path, 16)
-                        self.font_footer = ImageFont.truetype(font_path, 12)
-                        logger.info(f"成功加载字体（方式2）: {font_path}")
-                        loaded = True
-                        break
-                    except Exception as e2:
-                        logger.warning(f"方式2加载失败 {font_path}: {str(e2)}")
-                        pass
-
-                except Exception as e:
-                    logger.warning(f"加载字体 {font_path} 失败: {str(e)}")
-                    import traceback
-                    logger.warning(traceback.format_exc())
-                    continue
-
-            if not loaded:
-                logger.warning("所有自定义字体加载失败，使用默认字体（中文可能无法正常显示）")
-                self.font_title = ImageFont.load_default()
-                self.font_subtitle = ImageFont.load_default()
-                self.font_song_name = ImageFont.load_default()
-                self.font_song_info = ImageFont.load_default()
-                self.font_footer = ImageFont.load_default()
-        except Exception as e:
-            logger.error(f"字体加载过程发生错误: {str(e)}")
-            import traceback
-            logger.error(traceback.format_exc())
-            self.font_title = ImageFont.load_default()
-            self.font_subtitle = ImageFont.load_default()
-            self.font_song_name = ImageFont.load_default()
-            self.font_song_info = ImageFont.load_default()
-            self.font_footer = ImageFont.load_default()
+    COVER_SIZE = 100
+    # 封面解码: JPEG draft 缩放的目标倍数、缩放的 reducing_gap 和允许解码的最大像素数
+    COVER_DRAFT_FACTOR = 2
+    COVER_REDUCING_GAP = 2.0
+    MAX_COVER_PIXELS = 4096 * 4096
+    # 单张图片最多容纳的行数，保证高度不超过 Telegram 的 2560px 限制
+    MAX_ROWS_PER_IMAGE = (2560 - HEADER_HEIGHT - FOOTER_HEIGHT - PADDING * 3) // ITEM_HEIGHT
+
+    # 输出格式
+    IMAGE_FORMATS = ("png", "jpeg", "webp")
+    # 超过大小上限时依次尝试的降级编码（按编码开销从低到高）
+    FALLBACK_JPEG_QUALITIES = (85, 75, 60, 45)
+
+    def __init__(self, cover_concurrency: int = 8, cover_deadline: float = 6.0,
+                 cover_cache: Optional[CoverCache] = None, render_mode: str = "thread",
+                 render_workers: int = 2, max_pending_renders: int = 16, template_cache_size: int = 8,
+                 image_format: str = "png", image_quality: int = 85, png_compress_level: int = 6,
+                 image_max_bytes: int = 0, metrics: Optional[Metrics] = None,
+                 upstream: Optional[UpstreamClient] = None, image_cache: Optional[RenderedImageCache] = None):
+        self.metrics = metrics or Metrics()
+        self.upstream = upstream or UpstreamClient(metrics=self.metrics)
+        # 编码好的搜索结果图片缓存，相同结果直接复用
+        self.image_cache = image_cache
+
+        # 封面并发下载数与整体截止时间(秒)，超时未完成的封面使用占位图
+        self.cover_concurrency = max(1, int(cover_concurrency))
+        self.cover_deadline = max(0.1, float(cover_deadline))
+        self.cover_cache = cover_cache
+
+        # 渲染在线程池或进程池中执行，排队(含执行中)的任务数超过上限时直接拒绝
+        self.render_mode = "process" if render_mode == "process" else "thread"
+        self.render_workers = max(1, int(render_workers))
+        self.max_pending_renders = max(1, int(max_pending_renders))
+        self._pending_renders = 0
+        self._executor: Optional[Executor] = None
+
+        # 静态模板层缓存（按行数和起始序号）
+        self.template_cache_size = max(1, int(template_cache_size))
+        self._templates: "OrderedDict[Tuple[int, int], Image.Image]" = OrderedDict()
+        self._template_lock = threading.Lock()
+
+        # 输出编码: 格式、质量(JPEG/WebP)、PNG 压缩级别，以及可选的大小上限(0 表示不限制)
+        self.image_format = image_format.lower() if image_format.lower() in self.IMAGE_FORMATS else "png"
+        if self.image_format == "webp" and not features.check("webp"):
+            logger.warning("当前 Pillow 不支持 WebP，改用 JPEG 输出")
+            self.image_format = "jpeg"
+        self.image_quality = min(100, max(1, int(image_quality)))
+        self.png_compress_level = min(9, max(0, int(png_compress_level)))
+        self.image_max_bytes = max(0, int(image_max_bytes))
+
+    def _render_options(self) -> dict:
+        """进程池子进程创建绘制器所需的参数"""
+        return {
+            "template_cache_size": self.template_cache_size,
+            "image_format": self.image_format,
+            "image_quality": self.image_quality,
+            "png_compress_level": self.png_compress_level,
+            "image_max_bytes": self.image_max_bytes,
+        }
+
+    # 字体在首次绘制时加载，同一进程内的所有绘制器共用
+    @property
+    def font_title(self) -> ImageFont.ImageFont:
+        return load_font(self.FONT_PATHS, self.FONT_SIZE_TITLE)
+
+    @property
+    def font_subtitle(self) -> ImageFont.ImageFont:
+        return load_font(self.FONT_PATHS, self.FONT_SIZE_SUBTITLE)
+
+    @property
+    def font_song_name(self) -> ImageFont.ImageFont:
+        return load_font(self.FONT_PATHS, self.FONT_SIZE_SONG_NAME)
+
+    @property
+    def font_song_info(self) -> ImageFont.ImageFont:
+        return load_font(self.FONT_PATHS, self.FONT_SIZE_SONG_INFO)
+
+    @property
+    def font_footer(self) -> ImageFont.ImageFont:
+        return load_font(self.FONT_PATHS, self.FONT_SIZE_FOOTER)
 
     @staticmethod
-    def _draw_gradient(draw, width: int, height: int, start: Tuple[int, int, int], end: Tuple[int, int, int]):
-        """绘制渐变背景"""
-        for y in range(height):
-            r = int(start[0] + (end[0] - start[0]) * y / height)
-            g = int(start[1] + (end[1] - start[1]) * y / height)
-            b = int(start[2] + (end[2] - start[2]) * y / height)
-            draw.line([(0, y), (width, y)], fill=(r, g, b))
+    def _make_gradient(width: int, height: int, start: Tuple[int, int, int], end: Tuple[int, int, int]) -> Image.Image:
+        """生成纵向渐变背景（先生成单列渐变再横向拉伸，避免逐行绘制）"""
+        column = Image.linear_gradient("L").resize((1, height), Image.Resampling.BILINEAR)
+        column = ImageOps.colorize(column, start, end)
+        return column.resize((width, height), Image.Resampling.NEAREST)
 
     @staticmethod
     def _draw_rounded_rectangle(draw, xy, radius, fill=None, outline=None, width=1):
@@ -152,125 +1662,703 @@ class MusicSearchDrawer:
             draw.line([(x1, y1 + radius), (x1, y2 - radius)], fill=outline, width=width)
             draw.line([(x2, y1 + radius), (x2, y2 - radius)], fill=outline, width=width)
 
-    async def draw_search_result(self, keyword: str, result_data: dict, session) -> bytes:
-        """绘制搜索结果图片"""
+    def _draw_cover_placeholder(self, draw, x: int, y: int):
+        """绘制封面占位图"""
+        self._draw_rounded_rectangle(
+            draw,
+            (x, y, x + self.COVER_SIZE, y + self.COVER_SIZE),
+            radius=8,
+            fill=self.COLOR_COVER_PLACEHOLDER,
+            outline=self.COLOR_CARD_OUTLINE,
+            width=1
+        )
+
+    @staticmethod
+    def _has_alpha(cover_img: Image.Image) -> bool:
+        return cover_img.mode in ("RGBA", "LA", "PA") or "transparency" in cover_img.info
+
+    @classmethod
+    def _to_rgb(cls, cover_img: Image.Image) -> Image.Image:
+        """将任意模式的封面转换为 RGB，带透明通道的封面先叠加到卡片背景色上"""
+        if cover_img.mode == "RGB":
+            return cover_img
+        if cls._has_alpha(cover_img):
+            cover_img = cover_img.convert("RGBA")
+            background = Image.new("RGB", cover_img.size, cls.COLOR_CARD_BG)
+            background.paste(cover_img, mask=cover_img.getchannel("A"))
+            return background
+        return cover_img.convert("RGB")
+
+    @classmethod
+    def make_thumbnail(cls, data: bytes) -> bytes:
+        """将原始封面缩放为缩略图并编码为 JPEG
+
+        JPEG 封面使用 draft 模式在解码时直接按 1/2~1/8 缩小，避免解码完整的大图；
+        解码前检查像素数，超过 MAX_COVER_PIXELS 的封面直接放弃。
+        """
+        with Image.open(io.BytesIO(data)) as cover_img:
+            if cover_img.format == "JPEG":
+                # draft 会选择不小于目标尺寸的最小缩放比例，后续再精确缩放
+                cover_img.draft("RGB", (cls.COVER_SIZE * cls.COVER_DRAFT_FACTOR,) * 2)
+            width, height = cover_img.size
+            if width * height > cls.MAX_COVER_PIXELS:
+                raise ValueError(f"封面尺寸过大: {width}x{height}")
+            if cover_img.mode not in ("RGB", "RGBA"):
+                cover_img = cover_img.convert("RGBA" if cls._has_alpha(cover_img) else "RGB")
+            # 先缩放再叠加透明通道，背景合成只需处理缩略图大小的像素
+            cover_img = cover_img.resize((cls.COVER_SIZE, cls.COVER_SIZE), Image.Resampling.LANCZOS,
+                                         reducing_gap=cls.COVER_REDUCING_GAP)
+            cover_img = cls._to_rgb(cover_img)
+        with io.BytesIO() as output:
+            cover_img.save(output, format="JPEG", quality=90)
+            return output.getvalue()
+
+    def _make_thumbnails(self, downloaded: Dict[int, Tuple[Optional[str], bytes]]) -> Dict[int, bytes]:
+        """批量生成缩略图并写入缓存"""
+        thumbnails = {}
+        to_cache = {}
+        for idx, (cache_key, data) in downloaded.items():
+            try:
+                thumbnails[idx] = self.make_thumbnail(data)
+            except Exception as e:
+                logger.error(f"解析封面失败: {str(e)}")
+                continue
+            if cache_key:
+                to_cache[cache_key] = thumbnails[idx]
+        if self.cover_cache and to_cache:
+            self.cover_cache.put_many(to_cache)
+        return thumbnails
+
+    async def fetch_covers(self, session, songs: List[dict]) -> List[Optional[bytes]]:
+        """获取所有封面缩略图，返回与 songs 一一对应的数据（失败或超时为 None）
+
+        优先读取封面缓存，未命中的封面并发下载。
+        """
+        covers: List[Optional[bytes]] = [None] * len(songs)
+        cache_keys = [str(song_info["song_id"]) if song_info.get("song_id") else None for song_info in songs]
+
+        if self.cover_cache:
+            cached = await asyncio.to_thread(self.cover_cache.get_many, [key for key in cache_keys if key])
+            for idx, key in enumerate(cache_keys):
+                if key in cached:
+                    covers[idx] = cached[key]
+
+        semaphore = asyncio.Semaphore(self.cover_concurrency)
+
+        async def fetch_one(cover_url: str) -> Optional[bytes]:
+            async with semaphore:
+                status, data = await self.upstream.get_bytes(session, "cover", cover_url)
+                if status != 200:
+                    logger.warning(f"下载封面失败,状态码: {status}, URL: {cover_url}")
+                    self.metrics.error("cover_fetch")
+                    return None
+                self.metrics.add_bytes("cover", len(data))
+                return data
+
+        tasks = {}
+        for idx, song_info in enumerate(songs):
+            cover_url = song_info.get("cover_url")
+            if cover_url and covers[idx] is None:
+                tasks[idx] = asyncio.create_task(fetch_one(cover_url))
+
+        if not tasks:
+            return covers
+
         try:
-            songs = result_data.get("songs", [])
-            total = result_data.get("total", 0)
-
-            # 计算总高度
-            total_height = self.HEADER_HEIGHT + len(songs) * self.ITEM_HEIGHT + self.FOOTER_HEIGHT + self.PADDING * 3
-
-            # 创建图片
-            img = Image.new('RGB', (self.IMG_WIDTH, total_height), color=(255, 255, 255))
-            draw = ImageDraw.Draw(img)
-
-            # 绘制渐变背景
-            self._draw_gradient(draw, self.IMG_WIDTH, total_height, self.COLOR_BG_START, self.COLOR_BG_END)
-
-            # 绘制顶部装饰条
-            draw.rectangle([(0, 0), (self.IMG_WIDTH, 8)], fill=self.COLOR_ACCENT)
-
-            # 绘制标题
-            title_text = "音乐搜索"
-            draw.text((self.PADDING, 25), title_text, font=self.font_title, fill=self.COLOR_HEADER)
-
-            # 绘制关键词和结果数
-            keyword_text = f"关键词: {keyword}"
-            keyword_bbox = draw.textbbox((0, 0), keyword_text, font=self.font_subtitle)
-            keyword_width = keyword_bbox[2] - keyword_bbox[0]
-            draw.text((self.IMG_WIDTH - self.PADDING - keyword_width, 32), keyword_text,
-                     font=self.font_subtitle, fill=self.COLOR_SUBTITLE)
-
-            result_text = f"共找到 {total} 首歌曲"
-            draw.text((self.PADDING, 70), result_text, font=self.font_subtitle, fill=self.COLOR_SUBTITLE)
-
-            # 绘制分割线
-            draw.line([(self.PADDING, self.HEADER_HEIGHT - 5), (self.IMG_WIDTH - self.PADDING, self.HEADER_HEIGHT - 5)],
-                     fill=(200, 200, 200), width=2)
-
-            # 绘制每首歌曲
-            y_offset = self.HEADER_HEIGHT
-            for idx, song_info in enumerate(songs, 1):
-                # 绘制卡片背景（交替颜色）
-                card_bg = self.COLOR_CARD_BG if idx % 2 == 1 else (248, 250, 255)
-                self._draw_rounded_rectangle(
-                    draw,
-                    (self.PADDING, y_offset + 5, self.IMG_WIDTH - self.PADDING, y_offset + self.ITEM_HEIGHT - 5),
-                    radius=10,
-                    fill=card_bg,
-                    outline=self.COLOR_CARD_OUTLINE,
-                    width=1
-                )
+            done, pending = await asyncio.wait(tasks.values(), timeout=self.cover_deadline)
+        except asyncio.CancelledError:
+            # 调用方放弃绘制（如渐进式回复超过截止时间）时一并取消封面下载
+            for task in tasks.values():
+                task.cancel()
+            raise
+        for task in pending:
+            task.cancel()
+        if pending:
+            logger.warning(f"{len(pending)} 张封面超过 {self.cover_deadline}s 未下载完成，使用占位图")
+            await asyncio.gather(*pending, return_exceptions=True)
+
+        downloaded = {}
+        for idx, task in tasks.items():
+            if task not in done:
+                continue
+            if task.exception() is not None:
+                logger.error(f"下载封面失败: {str(task.exception())}")
+                self.metrics.error("cover_fetch")
+                continue
+            if task.result():
+                downloaded[idx] = (cache_keys[idx], task.result())
+
+        if downloaded:
+            thumbnails = await asyncio.to_thread(self._make_thumbnails, downloaded)
+            for idx, thumbnail in thumbnails.items():
+                covers[idx] = thumbnail
+
+        return covers
+
+    def image_key(self, keyword: str, result_data: dict, platform: str) -> str:
+        """搜索结果图片缓存键"""
+        return RenderedImageCache.fingerprint(keyword, result_data, platform, self._render_options())
+
+    async def cached_image(self, cache_key: str) -> Optional[bytes]:
+        """读取缓存的搜索结果图片，未命中返回 None"""
+        if self.image_cache is None:
+            return None
+        found = await asyncio.to_thread(self.image_cache.get_many, [cache_key])
+        return found.get(cache_key)
 
-                # 绘制序号
-                draw.text((self.PADDING + 15, y_offset + 15), str(idx),
-                         font=self.font_song_name, fill=self.COLOR_ACCENT)
+    async def draw_search_result(self, keyword: str, result_data: dict, session,
+                                 cache_key: Optional[str] = None) -> bytes:
+        """绘制搜索结果图片
 
-                # 下载封面图片
-                cover_url = song_info.get("cover_url")
-                if cover_url:
-                    try:
-                        async with session.get(cover_url, timeout=8) as cover_response:
-                            if cover_response.status == 200:
-                                cover_data = await cover_response.read()
-                                cover_img = Image.open(io.BytesIO(cover_data))
-                                cover_img = cover_img.resize((100, 100), Image.Resampling.LANCZOS)
-                                img.paste(cover_img, (self.PADDING + 55, y_offset + 10))
-                    except Exception as e:
-                        logger.error(f"下载封面失败: {str(e)}")
-
-                # 解析歌曲信息
-                text_lines = song_info.get("text", "").split('\n')
-                line_y = y_offset + 15
-                text_x = self.PADDING + 180
-
-                for line_idx, line in enumerate(text_lines):
-                    if line_idx == 0:  # 歌曲名
-                        draw.text((text_x, line_y), line, font=self.font_song_name, fill=self.COLOR_SONG_NAME)
-                    else:  # 其他信息
-                        draw.text((text_x, line_y), line, font=self.font_song_info, fill=self.COLOR_SONG_INFO)
-                    line_y += 24
-
-                y_offset += self.ITEM_HEIGHT
-
-            # 绘制底部版权（两行）
-            footer_text1 = "Neko云音乐 - Powered by 不穿胖次の小奶猫"
-            footer_text2 = "music.cnmsb.xin 蜀ICP备2025177767号-1"
-
-            # 第一行
-            footer_bbox1 = draw.textbbox((0, 0), footer_text1, font=self.font_footer)
-            footer_width1 = footer_bbox1[2] - footer_bbox1[0]
-            footer_x1 = (self.IMG_WIDTH - footer_width1) // 2
-            draw.text((footer_x1, total_height - self.FOOTER_HEIGHT + 8), footer_text1,
-                     font=self.font_footer, fill=self.COLOR_FOOTER)
-
-            # 第二行
-            footer_bbox2 = draw.textbbox((0, 0), footer_text2, font=self.font_footer)
-            footer_width2 = footer_bbox2[2] - footer_bbox2[0]
-            footer_x2 = (self.IMG_WIDTH - footer_width2) // 2
-            draw.text((footer_x2, total_height - self.FOOTER_HEIGHT + 26), footer_text2,
-                     font=self.font_footer, fill=self.COLOR_FOOTER)
-
-            # 转换为 bytes
-            with io.BytesIO() as output:
-                img.save(output, format='PNG', optimize=True)
-                return output.getvalue()
+        result_data 可以是 paginate 生成的分页视图，序号从 start + 1 开始。
+        指定 cache_key 时，所有封面都下载成功的图片会写入图片缓存（含占位图的不缓存）。
+        """
+        try:
+            songs = result_data.get("songs", [])
 
+            # 绘制前先并发下载全部封面
+            with self.metrics.track("cover_fetch"):
+                covers = await self.fetch_covers(session, songs)
+            complete = all(cover or not song_info.get("cover_url") for song_info, cover in zip(songs, covers))
+            return await self.render(keyword, result_data, covers, cache_key if complete else None)
+
+        except RenderQueueFullError:
+            raise
         except Exception as e:
             logger.error(f"绘制搜索结果图片失败: {str(e)}")
             import traceback
             logger.error(traceback.format_exc())
             return None
 
+    @classmethod
+    def paginate(cls, result_data: dict, page_size: int) -> List[dict]:
+        """将搜索结果按页拆分，每页为一个可直接绘制的 result_data 视图"""
+        songs = result_data.get("songs", [])
+        if page_size <= 0:
+            page_size = max(len(songs), 1)
+        page_size = min(page_size, cls.MAX_ROWS_PER_IMAGE)
+        chunks = [songs[start:start + page_size] for start in range(0, len(songs), page_size)] or [[]]
+        return [
+            {
+                "songs": chunk,
+                "total": result_data.get("total", 0),
+                "start": page * page_size,
+                "page": page,
+                "pages": len(chunks),
+            }
+            for page, chunk in enumerate(chunks)
+        ]
+
+    def _get_executor(self) -> Executor:
+        """获取渲染线程池/进程池（首次使用时创建）"""
+        if self._executor is None:
+            if self.render_mode == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.render_workers,
+                                                     initializer=_init_render_process,
+                                                     initargs=(self._render_options(),))
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.render_workers,
+                                                    thread_name_prefix="nekomusic-render")
+        return self._executor
+
+    async def render(self, keyword: str, result_data: dict, covers: List[Optional[bytes]],
+                     cache_key: Optional[str] = None) -> bytes:
+        """在渲染线程池/进程池中绘制图片，不阻塞事件循环，指定 cache_key 时结果写入图片缓存
+
+        排队计数在渲染任务真正结束时才释放: 等待方被取消（如渐进式回复超过截止时间）时，
+        尚未开始的任务直接取消，已在绘制的任务继续占用名额直到完成，完成的图片仍写入缓存。
+        """
+        if self._pending_renders >= self.max_pending_renders:
+            raise RenderQueueFullError(f"渲染任务过多({self._pending_renders})")
+
+        if self.render_mode == "process":
+            future = self._get_executor().submit(_render_in_process, keyword, result_data, covers)
+        else:
+            future = self._get_executor().submit(self.render_timed, keyword, result_data, covers)
+        self._pending_renders += 1
+        loop = asyncio.get_running_loop()
+        abandoned = [False]
+
+        def on_done(done_future):
+            # 在工作线程（或进程池的管理线程）中调用，回到事件循环中处理
+            with contextlib.suppress(RuntimeError):  # 事件循环已关闭
+                loop.call_soon_threadsafe(self._finish_render, done_future, cache_key, abandoned)
+
+        future.add_done_callback(on_done)
+
+        start = time.perf_counter()
+        try:
+            with self.metrics.track("render"):
+                data, draw_seconds, encode_seconds = await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            abandoned[0] = True
+            raise
+
+        # 总耗时减去绘制和编码即为在线程池/进程池中排队的时间
+        self.metrics.observe("render_draw", draw_seconds)
+        self.metrics.observe("render_encode", encode_seconds)
+        self.metrics.observe("render_wait", max(0.0, time.perf_counter() - start - draw_seconds - encode_seconds))
+        self.metrics.add_bytes("image", len(data))
+        if data and cache_key and self.image_cache is not None:
+            await asyncio.to_thread(self.image_cache.put_many, {cache_key: data})
+        return data
+
+    def _finish_render(self, future, cache_key: Optional[str], abandoned: List[bool]):
+        """渲染任务结束（完成、失败或被取消）时释放排队名额；无人等待的结果直接写入图片缓存"""
+        self._pending_renders -= 1
+        if not (abandoned[0] and cache_key and self.image_cache is not None):
+            return
+        if future.cancelled() or future.exception() is not None:
+            return
+        data = future.result()[0]
+        if data:
+            asyncio.get_running_loop().run_in_executor(None, self.image_cache.put_many, {cache_key: data})
+
+    def _build_template(self, rows: int, start: int = 0) -> Image.Image:
+        """绘制固定行数的静态模板层（背景、标题、卡片、序号、底部版权），序号从 start + 1 开始"""
+        # 计算总高度
+        total_height = self.HEADER_HEIGHT + rows * self.ITEM_HEIGHT + self.FOOTER_HEIGHT + self.PADDING * 3
+
+        # 绘制渐变背景
+        img = self._make_gradient(self.IMG_WIDTH, total_height, self.COLOR_BG_START, self.COLOR_BG_END)
+        draw = ImageDraw.Draw(img)
+
+        # 绘制顶部装饰条
+        draw.rectangle([(0, 0), (self.IMG_WIDTH, 8)], fill=self.COLOR_ACCENT)
+
+        # 绘制标题
+        title_text = "音乐搜索"
+        draw.text((self.PADDING, 25), title_text, font=self.font_title, fill=self.COLOR_HEADER)
+
+        # 绘制分割线
+        draw.line([(self.PADDING, self.HEADER_HEIGHT - 5), (self.IMG_WIDTH - self.PADDING, self.HEADER_HEIGHT - 5)],
+                  fill=(200, 200, 200), width=2)
+
+        # 绘制每行的卡片背景（交替颜色）和序号
+        y_offset = self.HEADER_HEIGHT
+        for idx in range(start + 1, start + rows + 1):
+            card_bg = self.COLOR_CARD_BG if idx % 2 == 1 else (248, 250, 255)
+            self._draw_rounded_rectangle(
+                draw,
+                (self.PADDING, y_offset + 5, self.IMG_WIDTH - self.PADDING, y_offset + self.ITEM_HEIGHT - 5),
+                radius=10,
+                fill=card_bg,
+                outline=self.COLOR_CARD_OUTLINE,
+                width=1
+            )
+            draw.text((self.PADDING + 15, y_offset + 15), str(idx),
+                      font=self.font_song_name, fill=self.COLOR_ACCENT)
+            y_offset += self.ITEM_HEIGHT
+
+        # 绘制底部版权（两行，居中）
+        for footer_text, footer_y in self.FOOTER_LINES:
+            footer_bbox = measure_text(footer_text, self.FONT_PATHS, self.FONT_SIZE_FOOTER)
+            footer_x = (self.IMG_WIDTH - (footer_bbox[2] - footer_bbox[0])) // 2
+            draw.text((footer_x, total_height - self.FOOTER_HEIGHT + footer_y), footer_text,
+                      font=self.font_footer, fill=self.COLOR_FOOTER)
+
+        return img
+
+    def _get_template(self, rows: int, start: int = 0) -> Image.Image:
+        """获取静态模板层（按行数和起始序号缓存，返回副本供绘制动态内容）"""
+        key = (rows, start)
+        with self._template_lock:
+            template = self._templates.get(key)
+            if template is not None:
+                self._templates.move_to_end(key)
+                return template.copy()
+
+        template = self._build_template(rows, start)
+        with self._template_lock:
+            self._templates[key] = template
+            while len(self._templates) > self.template_cache_size:
+                self._templates.popitem(last=False)
+        return template.copy()
+
+    def render_search_result(self, keyword: str, result_data: dict, covers: List[Optional[bytes]]) -> bytes:
+        """绘制搜索结果图片并编码（纯 CPU 计算，可在任意线程或进程中运行）"""
+        return self.render_timed(keyword, result_data, covers)[0]
+
+    def render_timed(self, keyword: str, result_data: dict, covers: List[Optional[bytes]]) -> Tuple[bytes, float, float]:
+        """绘制并编码，同时返回绘制和编码各自的耗时(秒)"""
+        start = time.perf_counter()
+        img = self.compose_search_result(keyword, result_data, covers)
+        drawn = time.perf_counter()
+        data = self.encode_image(img)
+        return data, drawn - start, time.perf_counter() - drawn
+
+    @staticmethod
+    def _encode(img: Image.Image, image_format: str, quality: int = 85, compress_level: int = 6) -> bytes:
+        """按指定格式编码图片"""
+        with io.BytesIO() as output:
+            if image_format == "jpeg":
+                img.save(output, format="JPEG", quality=quality, optimize=False, progressive=False)
+            elif image_format == "webp":
+                img.save(output, format="WEBP", quality=quality, method=4)
+            else:
+                img.save(output, format="PNG", compress_level=compress_level)
+            return output.getvalue()
+
+    def encode_image(self, img: Image.Image) -> bytes:
+        """按配置编码图片，设置了大小上限时选择不超限的开销最低的编码"""
+        data = self._encode(img, self.image_format, self.image_quality, self.png_compress_level)
+        if not self.image_max_bytes or len(data) <= self.image_max_bytes:
+            return data
+
+        smallest = data
+        for quality in self.FALLBACK_JPEG_QUALITIES:
+            if self.image_format == "jpeg" and quality >= self.image_quality:
+                continue
+            candidate = self._encode(img, "jpeg", quality)
+            if len(candidate) < len(smallest):
+                smallest = candidate
+            if len(candidate) <= self.image_max_bytes:
+                logger.info(f"图片超过大小上限({len(data)} > {self.image_max_bytes} bytes)，改用 JPEG 质量 {quality}")
+                return candidate
+
+        logger.warning(f"图片降级编码后仍超过大小上限: {len(smallest)} > {self.image_max_bytes} bytes")
+        return smallest
+
+    def compose_search_result(self, keyword: str, result_data: dict, covers: List[Optional[bytes]]) -> Image.Image:
+        """在静态模板层上绘制动态内容，返回未编码的图片"""
+        songs = result_data.get("songs", [])
+        total = result_data.get("total", 0)
+
+        # 静态部分来自模板，这里只绘制关键词、结果数、封面和歌曲信息
+        img = self._get_template(len(songs), result_data.get("start", 0))
+        draw = ImageDraw.Draw(img)
+
+        # 绘制关键词和结果数
+        keyword_text = f"关键词: {keyword}"
+        keyword_bbox = draw.textbbox((0, 0), keyword_text, font=self.font_subtitle)
+        keyword_width = keyword_bbox[2] - keyword_bbox[0]
+        draw.text((self.IMG_WIDTH - self.PADDING - keyword_width, 32), keyword_text,
+                  font=self.font_subtitle, fill=self.COLOR_SUBTITLE)
+
+        result_text = f"共找到 {total} 首歌曲"
+        if result_data.get("pages", 1) > 1:
+            result_text += f"  第 {result_data['page'] + 1}/{result_data['pages']} 页"
+        draw.text((self.PADDING, 70), result_text, font=self.font_subtitle, fill=self.COLOR_SUBTITLE)
+
+        # 绘制每首歌曲
+        y_offset = self.HEADER_HEIGHT
+        for idx, song_info in enumerate(songs):
+            # 绘制封面图片（未能按时下载的封面使用占位图）
+            cover_x, cover_y = self.PADDING + 55, y_offset + 10
+            cover_data = covers[idx]
+            if cover_data:
+                try:
+                    cover_img = Image.open(io.BytesIO(cover_data))
+                    if cover_img.mode != "RGB" or cover_img.size != (self.COVER_SIZE, self.COVER_SIZE):
+                        # 缓存中的缩略图应为 RGB JPEG，其它来源的数据统一规整后再粘贴
+                        cover_img = self._to_rgb(cover_img).resize((self.COVER_SIZE, self.COVER_SIZE),
+                                                                   Image.Resampling.LANCZOS)
+                    img.paste(cover_img, (cover_x, cover_y))
+                except Exception as e:
+                    logger.error(f"解析封面失败: {str(e)}")
+                    self._draw_cover_placeholder(draw, cover_x, cover_y)
+            elif song_info.get("cover_url"):
+                self._draw_cover_placeholder(draw, cover_x, cover_y)
+
+            # 解析歌曲信息
+            text_lines = song_info.get("text", "").split('\n')
+            line_y = y_offset + 15
+            text_x = self.PADDING + 180
+
+            for line_idx, line in enumerate(text_lines):
+                if line_idx == 0:  # 歌曲名
+                    draw.text((text_x, line_y), line, font=self.font_song_name, fill=self.COLOR_SONG_NAME)
+                else:  # 其他信息
+                    draw.text((text_x, line_y), line, font=self.font_song_info, fill=self.COLOR_SONG_INFO)
+                line_y += 24
+
+            y_offset += self.ITEM_HEIGHT
+
+        return img
+
+    def close(self):
+        """关闭渲染线程池/进程池"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+# 进程池模式下每个子进程各自持有一个绘制器（字体只加载一次）
+_process_drawer: Optional[MusicSearchDrawer] = None
+
+
+def _init_render_process(options: dict):
+    """进程池子进程初始化"""
+    global _process_drawer
+    _process_drawer = MusicSearchDrawer(**options)
+
+
+def _render_in_process(keyword: str, result_data: dict, covers: List[Optional[bytes]]) -> Tuple[bytes, float, float]:
+    """进程池渲染入口"""
+    global _process_drawer
+    if _process_drawer is None:
+        _process_drawer = MusicSearchDrawer()
+    return _process_drawer.render_timed(keyword, result_data, covers)
+
 
 @register("nekomusic", "NyaNyagulugulu", "Neko云音乐点歌插件", "1.7.0", "https://github.com/NyaNyagulugulu/astrbot_NekoMusic")
 class Main(Star):
-    def __init__(self, context: Context):
+    # Telegram 语音文件大小上限
+    TELEGRAM_AUDIO_LIMIT = 50 * 1024 * 1024
+    # 搜索结果消息中携带的结果编号，回复时据此找到对应的结果列表
+    RESULT_TOKEN_PATTERN = re.compile(r"结果编号 ([0-9A-Z]{5})")
+
+    def __init__(self, context: Context, config: AstrBotConfig = None):
         super().__init__(context)
-        self.drawer = MusicSearchDrawer()
-        # 存储每个会话的搜索结果，格式: {session_id: {"songs": [...], "timestamp": ...}}
-        self.search_results = {}
+        self.config = config or {}
+        # 各阶段耗时、吞吐和错误统计
+        self.metrics = Metrics()
+        self.api_base_url = (self.config.get("api_base_url") or DEFAULT_API_BASE_URL).rstrip("/")
+        # 音乐 API 请求层（自适应超时、封面对冲请求、按请求类型分别熔断），搜索、封面和音频共用
+        self.upstream = UpstreamClient(
+            failure_threshold=self.config.get("upstream_breaker_threshold", 5),
+            reset_timeout=self.config.get("upstream_breaker_reset", 30),
+            timeout_multiplier=self.config.get("upstream_timeout_multiplier", 3.0),
+            hedge=self.config.get("upstream_hedge", True),
+            metrics=self.metrics,
+        )
+        self.data_dir = str(StarTools.get_data_dir("astrbot_plugin_NekoMusic"))
+        self.cover_cache = CoverCache(
+            cache_dir=os.path.join(self.data_dir, "cover_cache"),
+            memory_bytes=int(self.config.get("cover_cache_memory_mb", 8) * 1024 * 1024),
+            disk_bytes=int(self.config.get("cover_cache_disk_mb", 64) * 1024 * 1024),
+            ttl=self.config.get("cover_cache_ttl_hours", 72) * 3600,
+        )
+        self.image_cache = RenderedImageCache(
+            cache_dir=os.path.join(self.data_dir, "image_cache"),
+            memory_bytes=int(self.config.get("image_cache_memory_mb", 16) * 1024 * 1024),
+            disk_bytes=int(self.config.get("image_cache_disk_mb", 0) * 1024 * 1024),
+            ttl=self.config.get("image_cache_ttl_hours", 24) * 3600,
+        )
+        self.drawer = MusicSearchDrawer(
+            cover_concurrency=self.config.get("cover_concurrency", 8),
+            cover_deadline=self.config.get("cover_deadline", 6.0),
+            cover_cache=self.cover_cache,
+            render_mode=self.config.get("render_mode", "thread"),
+            render_workers=self.config.get("render_workers", 2),
+            max_pending_renders=self.config.get("max_pending_renders", 16),
+            image_format=self.config.get("image_format", "png"),
+            image_quality=self.config.get("image_quality", 85),
+            png_compress_level=self.config.get("png_compress_level", 6),
+            image_max_bytes=int(self.config.get("image_max_kb", 0) * 1024),
+            metrics=self.metrics,
+            upstream=self.upstream,
+            image_cache=self.image_cache,
+        )
+        # 按结果编号存储搜索结果（精简记录，带有效期和数量上限），同一会话可同时保留多次搜索
+        results_ttl = self.config.get("search_results_ttl", 1800)
+        # 结果按结果编号保存，上限是结果条数而不是会话数；兼容旧配置项 search_results_max_sessions
+        results_max = self.config.get("search_results_max_entries",
+                                      self.config.get("search_results_max_sessions", 2000))
+        self.search_results = SearchResultStore(max_entries=results_max, ttl=results_ttl)
+        # 会话 ID -> 最近一次搜索的结果编号（平台不提供引用消息内容时使用）
+        self._latest_results = TTLCache(max_entries=results_max, ttl=results_ttl)
+        # (会话 ID, 被引用的消息 ID) -> 结果编号，首次解析后再次回复同一条消息可直接命中
+        # Telegram 的消息 ID 在每个聊天内单独计数，必须带上会话 ID 区分
+        self._reply_index = TTLCache(max_entries=results_max * 4, ttl=results_ttl)
+
+        # 搜索结果缓存（按规范化关键词）与相同搜索的请求合并
+        self.search_cache = TTLCache(
+            max_entries=self.config.get("search_cache_size", 256),
+            ttl=self.config.get("search_cache_ttl", 300),
+        )
+        self._search_flight = SingleFlight()
+        # 过期的搜索结果再保留一段时间，音乐 API 不可用时作为兜底
+        self._stale_search = TTLCache(
+            max_entries=self.config.get("search_cache_size", 256),
+            ttl=self.config.get("search_stale_ttl", 6 * 3600),
+        )
+
+        # 分页: page 模式每次发送一页并支持翻页; tiles 模式将全部结果拆分为多张图片一次发送
+        self.page_size = int(self.config.get("page_size", 10))
+        self.page_mode = "tiles" if self.config.get("page_mode", "page") == "tiles" else "page"
+
+        # 准入调度: 搜索、渲染和音频各自限制并发并排队，搜索优先，并限制单个会话/用户的并发
+        self.scheduler = AdmissionScheduler(
+            limits={
+                "search": self.config.get("scheduler_search_concurrency", 8),
+                "render": self.config.get("scheduler_render_concurrency", 4),
+                "audio": self.config.get("scheduler_audio_concurrency", 4),
+            },
+            total_limit=self.config.get("scheduler_total_concurrency", 12),
+            queue_limit=self.config.get("scheduler_queue_limit", 32),
+            per_session_limit=self.config.get("scheduler_per_session_limit", 3),
+            per_user_limit=self.config.get("scheduler_per_user_limit", 2),
+            per_session_queue_limit=self.config.get("scheduler_per_session_queue_limit", 8),
+            per_user_queue_limit=self.config.get("scheduler_per_user_queue_limit", 4),
+            metrics=self.metrics,
+        )
+
+        # 回复方式: image 等图片绘制完成后一起发送; progressive 先发送文字列表，图片在截止时间内绘制完成后补发
+        self.response_mode = "progressive" if self.config.get("response_mode", "image") == "progressive" else "image"
+        self.progressive_deadline = max(1.0, float(self.config.get("progressive_image_deadline", 15)))
+
+        # 音频流式下载（单文件大小上限与全局在途字节预算）
+        self.audio_downloader = AudioDownloader(
+            max_file_bytes=int(self.config.get("audio_max_mb", 200) * 1024 * 1024),
+            inflight_budget=int(self.config.get("audio_inflight_budget_mb", 512) * 1024 * 1024),
+            metrics=self.metrics,
+            upstream=self.upstream,
+        )
+        # 音频磁盘缓存，Record 组件直接使用缓存文件，热门歌曲无需重复下载
+        self.audio_cache = AudioCache(
+            cache_dir=os.path.join(self.data_dir, "audio_cache"),
+            max_bytes=int(self.config.get("audio_cache_mb", 1024) * 1024 * 1024),
+            downloader=self.audio_downloader,
+        )
+        # 搜索结果展示后预取前几首歌曲，用户选歌时直接使用（audio_prefetch_count 为 0 时关闭）
+        self.audio_prefetcher = AudioPrefetcher(
+            self.audio_cache,
+            count=self.config.get("audio_prefetch_count", 0),
+            concurrency=self.config.get("audio_prefetch_concurrency", 2),
+            budget_bytes=int(self.config.get("audio_prefetch_budget_mb", 256) * 1024 * 1024),
+            ttl=results_ttl,
+        )
+
+        # 可选的音频转码: Telegram 转为 OGG/Opus 语音，QQ 等平台转为较小的 MP3/AMR，结果单独缓存
+        self.transcode_formats = {
+            "telegram": self.config.get("transcode_telegram_format", "opus"),
+            "qq": self.config.get("transcode_qq_format", "mp3"),
+        }
+        self.audio_transcoder = AudioTranscoder(
+            AudioCache(
+                cache_dir=os.path.join(self.data_dir, "transcode_cache"),
+                max_bytes=int(self.config.get("transcode_cache_mb", 512) * 1024 * 1024),
+                downloader=self.audio_downloader,
+            ),
+            ffmpeg_path=self.config.get("ffmpeg_path", ""),
+            concurrency=self.config.get("transcode_concurrency", 2),
+            timeout=float(self.config.get("transcode_timeout", 120)),
+            bitrates={"opus": self.config.get("transcode_opus_bitrate", 64),
+                      "mp3": self.config.get("transcode_mp3_bitrate", 128)},
+            metrics=self.metrics,
+        )
+        self.transcode_enabled = bool(self.config.get("transcode_enabled", False))
+        if self.transcode_enabled and not self.audio_transcoder.enabled:
+            logger.warning("已开启音频转码，但未找到 ffmpeg，将直接发送原始音频")
+
+        # 插件生命周期内共享的 HTTP 连接池，首次使用时创建
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._session_lock = asyncio.Lock()
+
+        # 统计导出: 定期写入本地文件，和/或在本地端口提供 /metrics
+        self.metrics_file = self.config.get("metrics_file", "")
+        self.metrics_port = int(self.config.get("metrics_port", 0))
+        self._metrics_task: Optional[asyncio.Task] = None
+        self._metrics_runner: Optional[web.AppRunner] = None
+        try:
+            asyncio.get_running_loop()
+            self._start_metrics_export()
+        except RuntimeError:
+            # 插件在事件循环外加载时，延迟到首次请求时启动
+            pass
+
+    def _metrics_extra(self) -> Dict[str, dict]:
+        """各缓存和存储的统计"""
+        return {
+            "search_cache": {"hits": self.search_cache.hits, "misses": self.search_cache.misses,
+                             "entries": len(self.search_cache)},
+            "cover_cache": self.cover_cache.stats(),
+            "image_cache": self.image_cache.stats(),
+            "audio_cache": self.audio_cache.stats(),
+            "search_results": self.search_results.stats(),
+            "audio_downloader": {"inflight_bytes": self.audio_downloader.inflight_bytes},
+            "audio_prefetch": self.audio_prefetcher.stats(),
+            "audio_transcode": self.audio_transcoder.stats(),
+            "scheduler": self.scheduler.stats(),
+            "upstream": self.upstream.stats(),
+        }
+
+    def _start_metrics_export(self):
+        """启动统计导出（未配置时不执行任何操作）"""
+        if self._metrics_task is not None or (not self.metrics_file and not self.metrics_port):
+            return
+        self._metrics_task = asyncio.create_task(self._metrics_export_loop())
+
+    async def _metrics_export_loop(self):
+        """定期将统计写入文件，并在配置了端口时提供 HTTP 端点"""
+        if self.metrics_port:
+            # 端点启动失败（如端口被占用）不影响文件导出
+            await self._start_metrics_endpoint()
+
+        if not self.metrics_file:
+            return
+        interval = max(1.0, float(self.config.get("metrics_interval", 30)))
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(self._write_metrics_file, self.metrics.prometheus(self._metrics_extra()))
+            except Exception as e:
+                logger.warning(f"写入统计文件失败: {str(e)}")
+
+    async def _start_metrics_endpoint(self):
+        """在 metrics_port 上提供 /metrics 端点，启动失败时记录日志"""
+        async def handle_metrics(request):
+            return web.Response(text=self.metrics.prometheus(self._metrics_extra()),
+                                content_type="text/plain", charset="utf-8")
+
+        host = self.config.get("metrics_host", "127.0.0.1")
+        app = web.Application()
+        app.router.add_get("/metrics", handle_metrics)
+        runner = web.AppRunner(app)
+        try:
+            await runner.setup()
+            await web.TCPSite(runner, host, self.metrics_port).start()
+        except Exception as e:
+            logger.error(f"统计端点启动失败 ({host}:{self.metrics_port}): {str(e)}")
+            await runner.cleanup()
+            return
+        self._metrics_runner = runner
+        logger.info(f"统计端点已启动: http://{host}:{self.metrics_port}/metrics")
+
+    def _write_metrics_file(self, text: str):
+        """原子写入统计文件（供 node_exporter textfile collector 等读取）"""
+        tmp_path = f"{self.metrics_file}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, self.metrics_file)
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """获取共享的 aiohttp 会话（搜索、封面和音频下载复用同一连接池）"""
+        self._start_metrics_export()
+        if self._session is not None and not self._session.closed:
+            return self._session
+        async with self._session_lock:
+            if self._session is None or self._session.closed:
+                connector = aiohttp.TCPConnector(
+                    limit=self.config.get("http_pool_size", 32),
+                    limit_per_host=self.config.get("http_pool_per_host", 16),
+                    ttl_dns_cache=300,
+                    keepalive_timeout=self.config.get("http_keepalive_timeout", 60),
+                )
+                self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def terminate(self):
+        """插件卸载时关闭共享连接池"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        self.audio_prefetcher.close()
+        self.drawer.close()
+        if self._metrics_task is not None:
+            self._metrics_task.cancel()
+            self._metrics_task = None
+        if self._metrics_runner is not None:
+            await self._metrics_runner.cleanup()
+            self._metrics_runner = None
+
+    # 指令名不能以「点歌」开头，否则会同时触发 search_music 的正则
+    @filter.command("音乐统计")
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    async def show_stats(self, event: AstrMessageEvent):
+        """查看各阶段耗时、流量和缓存统计（仅管理员）"""
+        yield event.plain_result(self.metrics.summary(self._metrics_extra()))
 
     @filter.regex(r"^点歌.*")
     async def search_music(self, event: AstrMessageEvent):
@@ -282,46 +2370,257 @@ class Main(Star):
             yield event.plain_result("请输入要搜索的歌曲名称,例如:点歌 Lemon")
             return
 
-        api_url = "https://music.cnmsb.xin/api/music/search"
-        json_data = {"query": keyword}
-
+        start = time.perf_counter()
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(api_url, json=json_data, timeout=10) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        result_data = self.handle_search_result(data)
-
-                        # 保存搜索结果到会话
-                        session_id = event.session_id
-                        self.search_results[session_id] = {
-                            "songs": data.get("results", [])
-                        }
-
-                        # 使用 drawer 绘制图片
-                        image_bytes = await self.drawer.draw_search_result(keyword, result_data, session)
-
-                        if image_bytes:
-                            # 获取当前平台
-                            platform = self._get_platform(event)
-                            
-                            # 构建提示文本
-                            if platform == 'telegram':
-                                hint_text = f"🎵 搜索结果: {keyword}\n共找到 {result_data.get('total', 0)} 首歌曲\n💡 点击回复按钮并输入序号即可播放"
-                            else:
-                                hint_text = f"🎵 搜索结果: {keyword}\n共找到 {result_data.get('total', 0)} 首歌曲\n💡 回复序号即可播放,例如: 1"
-                            
-                            yield event.chain_result([
-                                Comp.Plain(hint_text),
-                                Comp.Image.fromBytes(image_bytes)
-                            ])
-                        else:
-                            yield event.plain_result("图片生成失败，请稍后重试")
-                    else:
-                        yield event.plain_result(f"搜索失败,API 返回状态码: {response.status}")
+            async with self.scheduler.slot("search", event.session_id, self._sender_id(event)):
+                status, data, result_data = await self._search(keyword)
+            if status == 200:
+                # 保存搜索结果，并记为该会话最近一次搜索
+                pages = self.drawer.paginate(result_data, self.page_size)
+                songs = tuple(SongRecord.from_api(song) for song in data.get("results") or [])
+                token = self._new_result_token()
+                self.search_results.put(token, SearchSession(token, keyword, songs, result_data.get("total", 0)))
+                self._latest_results.put(event.session_id, token)
+                hint_text = self._build_hint(event, token, keyword, result_data, pages[0])
+
+                if self.response_mode == "progressive":
+                    # 先发送文字结果列表，图片绘制完成后再补发（超过截止时间则不再发送）
+                    with self.metrics.track("upload"):
+                        yield event.plain_result(f"{hint_text}\n\n{self._build_listing(songs, pages[0])}")
+                    try:
+                        images = await asyncio.wait_for(self._draw_result_images(event, keyword, pages),
+                                                        self.progressive_deadline)
+                    except asyncio.TimeoutError:
+                        logger.warning(f"搜索结果图片超过 {self.progressive_deadline}s 未绘制完成，不再发送")
+                        images = []
+                    except (RenderQueueFullError, AdmissionRejectedError) as e:
+                        logger.warning(f"拒绝渲染搜索结果: {str(e)}")
+                        images = []
+                    if images:
+                        with self.metrics.track("upload"):
+                            yield event.chain_result(
+                                [Comp.Plain(f"🔖 结果编号 {token}")]
+                                + [Comp.Image.fromBytes(image_bytes) for image_bytes in images]
+                            )
+                else:
+                    images = await self._draw_result_images(event, keyword, pages)
+                    if not images:
+                        yield event.plain_result("图片生成失败，请稍后重试")
+                        return
+                    with self.metrics.track("upload"):
+                        yield event.chain_result(
+                            [Comp.Plain(hint_text)] + [Comp.Image.fromBytes(image_bytes) for image_bytes in images]
+                        )
+
+                # 结果已展示，趁用户选歌时在后台预取前几首
+                if self.audio_prefetcher.enabled:
+                    self.audio_prefetcher.schedule(
+                        token, await self._get_session(),
+                        [(song.id, self._audio_url(song.id)) for song in songs if song.id],
+                        self._download_limit(self._get_platform(event)),
+                    )
+            else:
+                yield event.plain_result(f"搜索失败,API 返回状态码: {status}")
+        except (RenderQueueFullError, AdmissionRejectedError) as e:
+            logger.warning(f"拒绝渲染搜索结果: {str(e)}")
+            yield event.plain_result("当前点歌的人太多啦，请稍后再试")
+        except UpstreamUnavailableError:
+            self.metrics.error("search_total")
+            yield event.plain_result("音乐服务暂时不可用，请稍后再试")
         except Exception as e:
             logger.error(f"搜索音乐时发生错误: {str(e)}")
+            self.metrics.error("search_total")
             yield event.plain_result(f"搜索失败: {str(e)}")
+        finally:
+            self.metrics.observe("search_total", time.perf_counter() - start)
+
+    @filter.regex(r"^(上一页|下一页)$")
+    async def turn_page(self, event: AstrMessageEvent):
+        """翻页（使用已保存的搜索结果重新绘制，不重新请求搜索 API）
+
+        引用某条搜索结果消息时翻该结果的页，否则翻该会话最近一次搜索的页。
+        """
+        if self.page_mode == "tiles":
+            return
+        reply_msg = self._find_reply(event)
+        search_data = self._resolve_result_set(event, reply_msg) if reply_msg else self._latest_result_set(event)
+        if not search_data:
+            return
+
+        pages = self.drawer.paginate(search_data.result_data(self.api_base_url), self.page_size)
+        if len(pages) <= 1:
+            return
+        step = 1 if event.message_str.strip() == "下一页" else -1
+        page = search_data.page + step
+        if page < 0 or page >= len(pages):
+            yield event.plain_result("已经是最后一页了" if step > 0 else "已经是第一页了")
+            return
+
+        try:
+            image_bytes = await self._draw_page(event, search_data.keyword, pages[page])
+            if image_bytes:
+                search_data.page = page
+                hint_text = self._build_hint(event, search_data.token, search_data.keyword, pages[page], pages[page])
+                with self.metrics.track("upload"):
+                    yield event.chain_result([
+                        Comp.Plain(hint_text),
+                        Comp.Image.fromBytes(image_bytes)
+                    ])
+            else:
+                yield event.plain_result("图片生成失败，请稍后重试")
+        except (RenderQueueFullError, AdmissionRejectedError) as e:
+            logger.warning(f"拒绝渲染搜索结果: {str(e)}")
+            yield event.plain_result("当前点歌的人太多啦，请稍后再试")
+
+    async def _draw_result_images(self, event: AstrMessageEvent, keyword: str, pages: List[dict]) -> List[bytes]:
+        """绘制一次搜索要发送的图片（tiles 模式为全部页，否则为第一页），任一页失败时返回空列表"""
+        images = []
+        for page_data in (pages if self.page_mode == "tiles" else pages[:1]):
+            image_bytes = await self._draw_page(event, keyword, page_data)
+            if not image_bytes:
+                return []
+            images.append(image_bytes)
+        return images
+
+    async def _draw_page(self, event: AstrMessageEvent, keyword: str, page_data: dict) -> Optional[bytes]:
+        """绘制一页搜索结果（封面下载和渲染占用一个渲染名额）"""
+        # 相同的结果（歌曲、页码、平台和输出格式一致）直接使用缓存的图片，不下载封面也不绘制
+        cache_key = self.drawer.image_key(keyword, page_data, self._get_platform(event))
+        image_bytes = await self.drawer.cached_image(cache_key)
+        if image_bytes:
+            return image_bytes
+
+        session = await self._get_session()
+        async with self.scheduler.slot("render", event.session_id, self._sender_id(event)):
+            image_bytes = await self.drawer.draw_search_result(keyword, page_data, session, cache_key=cache_key)
+        logger.info(f"封面缓存统计: {self.cover_cache.stats()}")
+        return image_bytes
+
+    def _build_hint(self, event: AstrMessageEvent, token: str, keyword: str, result_data: dict,
+                    page_data: dict) -> str:
+        """构建搜索结果提示文本"""
+        platform = self._get_platform(event)
+        hint_text = f"🎵 搜索结果: {keyword}\n共找到 {result_data.get('total', 0)} 首歌曲"
+        if page_data.get("pages", 1) > 1 and self.page_mode != "tiles":
+            hint_text += f"，第 {page_data['page'] + 1}/{page_data['pages']} 页"
+
+        if platform == 'telegram':
+            hint_text += "\n💡 点击回复按钮并输入序号即可播放"
+        else:
+            hint_text += "\n💡 回复序号即可播放,例如: 1"
+
+        if page_data.get("pages", 1) > 1 and self.page_mode != "tiles":
+            hint_text += "\n📄 发送「上一页」「下一页」翻页"
+        hint_text += f"\n🔖 结果编号 {token}"
+        return hint_text
+
+    @staticmethod
+    def _build_listing(songs: Tuple[SongRecord, ...], page_data: dict) -> str:
+        """构建精简的文字结果列表（第一页的歌曲）"""
+        start = page_data.get("start", 0)
+        lines = []
+        for idx, song in enumerate(songs[start:start + len(page_data.get("songs", []))], start + 1):
+            lines.append(f"{idx}. {song.name} - {song.artist}")
+        return "\n".join(lines) if lines else "未找到相关歌曲"
+
+    def _new_result_token(self) -> str:
+        """生成新的结果编号"""
+        while True:
+            token = "".join(random.choices(string.digits + string.ascii_uppercase, k=5))
+            if self.search_results.get(token) is None:
+                return token
+
+    @staticmethod
+    def _find_reply(event: AstrMessageEvent):
+        """从消息链中查找 Reply 组件"""
+        message_obj = getattr(event, 'message_obj', None)
+        for comp in getattr(message_obj, 'message', None) or ():
+            if getattr(comp, 'type', None) == 'Reply':
+                return comp
+        return None
+
+    def _latest_result_set(self, event: AstrMessageEvent) -> Optional[SearchSession]:
+        """会话最近一次搜索的结果"""
+        # 处理 Telegram 的会话 ID (可能包含消息 ID, 如: -1001934802217#27946)
+        # 优先匹配群组/聊天 ID 部分（# 之前的部分），再尝试直接匹配（兼容其他平台）
+        session_id = event.session_id
+        for key in (session_id.split('#')[0], session_id):
+            token = self._latest_results.get(key)
+            if token is not None:
+                return self.search_results.get(token)
+        return None
+
+    def _resolve_result_set(self, event: AstrMessageEvent, reply_msg) -> Optional[SearchSession]:
+        """根据被引用的消息找到对应的搜索结果，不是搜索结果消息时返回 None"""
+        reply_id = getattr(reply_msg, 'id', None)
+        index_key = f"{event.session_id}:{reply_id}"
+        if reply_id is not None:
+            token = self._reply_index.get(index_key)
+            if token is not None:
+                return self.search_results.get(token)
+
+        # 从被引用消息的文本中解析结果编号
+        reply_text = getattr(reply_msg, 'message_str', None) or getattr(reply_msg, 'text', None)
+        if reply_text:
+            match = self.RESULT_TOKEN_PATTERN.search(reply_text)
+            if not match:
+                return None
+            search_data = self.search_results.get(match.group(1))
+            if search_data is not None and reply_id is not None:
+                self._reply_index.put(index_key, match.group(1))
+            return search_data
+
+        # 平台未提供被引用消息的内容时，退回到会话最近一次搜索
+        return self._latest_result_set(event)
+
+    @staticmethod
+    def _normalize_keyword(keyword: str) -> str:
+        """规范化搜索关键词，用作缓存键"""
+        return " ".join(keyword.split()).lower()
+
+    async def _search(self, keyword: str) -> Tuple[int, Optional[dict], Optional[dict]]:
+        """搜索音乐，返回 (状态码, 原始响应, handle_search_result 结果)
+
+        相同关键词优先命中缓存；并发的相同搜索只向上游发送一次请求。
+        """
+        cache_key = self._normalize_keyword(keyword)
+        cached = self.search_cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"搜索缓存命中: {cache_key}")
+            return cached
+        return await self._search_flight.do(cache_key, lambda: self._fetch_search(keyword, cache_key))
+
+    async def _fetch_search(self, keyword: str, cache_key: str) -> Tuple[int, Optional[dict], Optional[dict]]:
+        """请求搜索 API 并解析结果，成功的结果写入缓存"""
+        api_url = f"{self.api_base_url}/api/music/search"
+        json_data = {"query": keyword}
+
+        session = await self._get_session()
+        try:
+            with self.metrics.track("search_api"):
+                async with self.upstream.request(session, "POST", "search", api_url, json=json_data) as response:
+                    if response.status != 200:
+                        self.metrics.error("search_api")
+                        if response.status >= 500:
+                            stale = self._stale_search.get(cache_key)
+                            if stale is not None:
+                                logger.warning(f"搜索 API 返回 {response.status}，使用之前的搜索结果: {cache_key}")
+                                return stale
+                        return response.status, None, None
+                    data = await response.json()
+        except (UpstreamUnavailableError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+            # 音乐 API 不可用（熔断、超时或连接失败）时使用之前的搜索结果兜底
+            stale = self._stale_search.get(cache_key)
+            if stale is None:
+                raise
+            logger.warning(f"搜索 API 不可用({type(e).__name__})，使用之前的搜索结果: {cache_key}")
+            return stale
+
+        result = (200, data, self.handle_search_result(data))
+        if data.get("success"):
+            self.search_cache.put(cache_key, result)
+            self._stale_search.put(cache_key, result)
+        return result
 
     def handle_search_result(self, data: dict) -> dict:
         """处理搜索结果"""
@@ -338,35 +2637,44 @@ class Main(Star):
 
             # 显示所有歌曲
             for idx, song in enumerate(songs, 1):
-                song_name = song.get("name", song.get("title", "未知歌曲"))
-                artist = song.get("artist", song.get("singer", song.get("ar", "未知歌手")))
-                album = song.get("album", song.get("al", "未知专辑"))
-                song_id = song.get("id", "")
-
                 # 打印完整的歌曲数据结构用于调试
                 logger.info(f"歌曲 {idx} 数据: {song}")
-
-                # 使用封面 API 获取封面图片
-                cover_url = None
-                if song_id:
-                    cover_url = f"https://music.cnmsb.xin/api/music/cover/{song_id}"
-
-                # 构建歌曲信息文本
-                song_text = f"{song_name}\n"
-                song_text += f"歌手: {artist}\n"
-                song_text += f"专辑: {album}\n"
-                if song_id:
-                    song_text += f"平台音乐ID: {song_id}"
-
-                result["songs"].append({
-                    "cover_url": cover_url,
-                    "text": song_text
-                })
+                result["songs"].append(SongRecord.from_api(song).to_display(self.api_base_url))
         else:
             result["songs"] = [{"cover_url": None, "text": f"搜索失败: {data.get('message', '未知错误')}"}]
 
         return result
 
+    def _audio_url(self, song_id) -> str:
+        """歌曲音频地址"""
+        return f"{self.api_base_url}/api/music/file/{song_id}"
+
+    def _audio_limit(self, platform: str) -> Optional[int]:
+        """平台的语音文件大小上限
+
+        Telegram 限制: 语音文件最大 50MB, 根据 Content-Length 在下载前拒绝
+        """
+        return self.TELEGRAM_AUDIO_LIMIT if platform == 'telegram' else None
+
+    def _transcode_profile(self, platform: str) -> Optional[str]:
+        """平台对应的转码格式，未开启转码或配置为 none 时返回 None"""
+        if not (self.transcode_enabled and self.audio_transcoder.enabled):
+            return None
+        profile = self.transcode_formats["telegram" if platform == 'telegram' else "qq"]
+        return profile if profile in AudioTranscoder.PROFILES else None
+
+    def _download_limit(self, platform: str) -> Optional[int]:
+        """下载源音频的大小上限: 需要转码时先完整下载，由转码结果检查平台上限"""
+        return None if self._transcode_profile(platform) else self._audio_limit(platform)
+
+    @staticmethod
+    def _sender_id(event: AstrMessageEvent) -> str:
+        """发送者 ID（用于按用户限制并发）"""
+        try:
+            return str(event.get_sender_id())
+        except Exception:
+            return ""
+
     def _get_platform(self, event: AstrMessageEvent) -> str:
         """获取当前平台类型"""
         # 尝试从事件中获取平台信息
@@ -399,31 +2707,23 @@ class Main(Star):
         if not msg_text.isdigit():
             return
 
-        platform = self._get_platform(event)
-        logger.info(f"当前平台: {platform}")
-
-        # 检查是否引用了消息 - 从消息链中查找 Reply 组件
-        reply_msg = None
-        if hasattr(event, 'message_obj') and hasattr(event.message_obj, 'message'):
-            components = event.message_obj.message
-            # 遍历消息链查找 Reply 组件
-            for comp in components:
-                if hasattr(comp, 'type') and comp.type == 'Reply':
-                    reply_msg = comp
-                    logger.info(f"找到 Reply 组件: {reply_msg}")
-                    break
-
-        if not reply_msg:
-            logger.info("没有引用消息，跳过播放")
+        # 快速拒绝: 没有引用消息，或引用的不是已知的搜索结果消息（不记录日志、不检测平台）
+        reply_msg = self._find_reply(event)
+        if reply_msg is None:
+            return
+        search_data = self._resolve_result_set(event, reply_msg)
+        if search_data is None:
             return
 
+        platform = self._get_platform(event)
+        logger.info(f"当前平台: {platform}, 找到 Reply 组件: {reply_msg}")
+
         # 检查引用的消息发送者是否是机器人自己
         # Telegram 平台: sender_id 是数字, bot_id 可能是字符串名称
         # QQ 平台: 两者都是数字字符串
         if hasattr(reply_msg, 'sender_id'):
             reply_sender_id = reply_msg.sender_id
             bot_id = event.get_self_id()
-            platform = self._get_platform(event)
 
             # Telegram 特殊处理: 检查 Reply 组件的 sender_nickname 是否与 bot_id 匹配
             if platform == 'telegram':
@@ -449,30 +2749,8 @@ class Main(Star):
         index = int(msg_text) - 1  # 转换为 0-based 索引
         logger.info(f"用户输入序号: {msg_text}, 转换后索引: {index}")
 
-        # 获取会话的搜索结果
-        session_id = event.session_id
-        logger.info(f"会话ID: {session_id}")
-        logger.info(f"已保存的搜索结果会话: {list(self.search_results.keys())}")
-        
-        # 处理 Telegram 的会话 ID (可能包含消息 ID, 如: -1001934802217#27946)
-        # 提取群组/聊天 ID 部分（# 之前的部分）
-        match_session_id = session_id.split('#')[0] if '#' in session_id else session_id
-        logger.info(f"匹配使用的会话ID: {match_session_id}")
-        
-        # 检查是否有匹配的搜索结果
-        if match_session_id in self.search_results:
-            search_data = self.search_results[match_session_id]
-            songs = search_data["songs"]
-            logger.info(f"找到 {len(songs)} 首歌曲")
-        elif session_id in self.search_results:
-            # 尝试直接匹配（兼容其他平台）
-            search_data = self.search_results[session_id]
-            songs = search_data["songs"]
-            logger.info(f"直接匹配找到 {len(songs)} 首歌曲")
-        else:
-            # 如果没有搜索结果，不处理（让其他过滤器处理）
-            logger.info(f"会话 {session_id} 或 {match_session_id} 没有搜索结果，跳过播放")
-            return
+        songs = search_data.songs
+        logger.info(f"结果编号 {search_data.token} 共 {len(songs)} 首歌曲, 已保存的搜索结果: {self.search_results.stats()}")
 
         # 检查索引是否有效
         if index < 0 or index >= len(songs):
@@ -482,75 +2760,84 @@ class Main(Star):
         # 获取歌曲信息
         logger.info(f"准备播放第 {index + 1} 首歌曲")
         song = songs[index]
-        song_name = song.get("name", song.get("title", "未知歌曲"))
-        song_id = song.get("id", "")
+        song_name = song.name
+        song_id = song.id
 
         if not song_id:
             yield event.plain_result("该歌曲没有有效的 ID，无法播放")
             return
 
         # 生成播放链接
-        play_url = f"https://music.cnmsb.xin/detail/{song_id}"
-        audio_url = f"https://music.cnmsb.xin/api/music/file/{song_id}"
+        play_url = f"{self.api_base_url}/detail/{song_id}"
+        audio_url = self._audio_url(song_id)
+        self.audio_prefetcher.claim(search_data.token)
 
         # 先返回播放链接
         yield event.chain_result([
             Comp.Plain(f"🎶 Neko云音乐。听见好音乐\n🔗 {play_url}\n🎵 正在发送音乐，请稍后\n平台内均为无损音质，发送可能较慢，请耐心等待..."),
         ])
 
-        # 下载音频并发送语音
+        # 下载音频并发送语音（已在预取的歌曲直接使用缓存或加入正在进行的下载）
+        max_bytes = self._audio_limit(platform)
+        profile = self._transcode_profile(platform)
+        audio_path = None
+        send_path = None
+        start = time.perf_counter()
         try:
-            async with aiohttp.ClientSession() as session:
-                logger.info(f"尝试下载音频: {audio_url}")
-                async with session.get(audio_url, timeout=60) as audio_response:
-                    logger.info(f"音频响应状态码: {audio_response.status}")
-                    if audio_response.status == 200:
-                        audio_data = await audio_response.read()
-                        audio_size_mb = len(audio_data) / (1024 * 1024)
-                        logger.info(f"音频数据大小: {len(audio_data)} bytes ({audio_size_mb:.2f} MB)")
-
-                        # Telegram 限制: 语音文件最大 50MB, 超过建议使用音频文件
-                        if platform == 'telegram' and audio_size_mb > 50:
-                            logger.warning(f"音频文件过大 ({audio_size_mb:.2f}MB), 超过 Telegram 语音限制 50MB")
-                            yield event.plain_result(f"⚠️ 音频文件较大 ({audio_size_mb:.2f}MB)，超过 Telegram 语音限制\n请直接点击播放链接收听: {play_url}")
-                            return
-
-                        # 根据平台选择音频格式
-                        # Telegram 支持 MP3, OGG, M4A 等格式
-                        # QQ 主要支持 SILK/AMR 格式，但也支持发送音频文件
-                        audio_format = '.mp3' if platform == 'telegram' else '.mp3'
-
-                        # 保存为临时文件
-                        import tempfile
-                        with tempfile.NamedTemporaryFile(delete=False, suffix=audio_format) as temp_file:
-                            temp_file.write(audio_data)
-                            temp_path = temp_file.name
-                        logger.info(f"音频已保存到临时文件: {temp_path}")
-
-                        # 发送语音（使用 Record 组件，传入文件路径）
-                        # Record 组件会自动根据平台适配格式
-                        logger.info(f"开始发送语音到 {platform} 平台")
-                        try:
-                            yield event.chain_result([
-                                Comp.Record(file=temp_path)
-                            ])
-                            logger.info("语音发送成功")
-                        except Exception as send_error:
-                            logger.error(f"发送语音失败: {str(send_error)}")
-                            # 如果发送失败，提供备用方案
-                            yield event.plain_result(f"⚠️ 语音发送失败，请直接点击播放链接收听: {play_url}")
-
-                        # 清理临时文件
-                        import os
-                        try:
-                            os.unlink(temp_path)
-                            logger.info(f"已清理临时文件: {temp_path}")
-                        except Exception as cleanup_error:
-                            logger.warning(f"清理临时文件失败: {str(cleanup_error)}")
-                    else:
-                        response_text = await audio_response.text()
-                        logger.error(f"下载音频失败,状态码: {audio_response.status}, 响应: {response_text}")
-                        yield event.plain_result(f"❌ 音频下载失败(状态码: {audio_response.status})")
+            session = await self._get_session()
+            logger.info(f"尝试获取音频: {audio_url}")
+            # 已缓存的歌曲无需下载，不占用音频名额
+            slot = (contextlib.nullcontext() if self.audio_cache.cached(song_id)
+                    else self.scheduler.slot("audio", event.session_id, self._sender_id(event)))
+            with self.metrics.track("audio_fetch"):
+                async with slot:
+                    audio_path = await self.audio_cache.acquire(
+                        session, song_id, audio_url, max_bytes=self._download_limit(platform))
+            logger.info(f"音频缓存文件: {audio_path}, 缓存统计: {self.audio_cache.stats()}")
+
+            if profile:
+                # 转码为平台适合的紧凑格式，失败时退回发送原始文件
+                try:
+                    send_path = await self.audio_transcoder.transcode(song_id, audio_path, profile, max_bytes)
+                    logger.info(f"音频已转码为 {profile}: {send_path}")
+                except (TranscodeError, OSError) as e:
+                    logger.warning(f"音频转码失败，发送原始文件: {str(e)}")
+                    profile = None
+            original_size = self.audio_cache.size(audio_path)
+            if send_path is None and max_bytes and original_size > max_bytes:
+                raise AudioTooLargeError(original_size, max_bytes)
+            sent_size = self.audio_transcoder.cache.size(send_path) if send_path else original_size
+
+            # 发送语音（使用 Record 组件，传入文件路径）
+            # Record 组件会自动根据平台适配格式
+            logger.info(f"开始发送语音到 {platform} 平台")
+            try:
+                # 按发送的格式分别统计耗时，用于对比转码前后的发送延迟
+                with self.metrics.track("audio_send"), self.metrics.track(f"audio_send_{profile or 'original'}"):
+                    yield event.chain_result([
+                        Comp.Record(file=send_path or audio_path)
+                    ])
+                self.audio_transcoder.record_send(original_size, sent_size)
+                logger.info("语音发送成功")
+            except Exception as send_error:
+                logger.error(f"发送语音失败: {str(send_error)}")
+                # 如果发送失败，提供备用方案
+                yield event.plain_result(f"⚠️ 语音发送失败，请直接点击播放链接收听: {play_url}")
+        except AudioTooLargeError as e:
+            size_mb = e.size / (1024 * 1024)
+            logger.warning(f"音频文件过大 ({size_mb:.2f}MB), 超过上限 {e.limit / (1024 * 1024):.0f}MB")
+            if platform == 'telegram' and e.limit == self.TELEGRAM_AUDIO_LIMIT:
+                yield event.plain_result(f"⚠️ 音频文件较大 ({size_mb:.2f}MB)，超过 Telegram 语音限制\n请直接点击播放链接收听: {play_url}")
+            else:
+                yield event.plain_result(f"⚠️ 音频文件过大 ({size_mb:.2f}MB)\n请直接点击播放链接收听: {play_url}")
+        except UpstreamUnavailableError:
+            yield event.plain_result(f"⚠️ 音乐服务暂时不可用，请直接点击播放链接收听: {play_url}")
+        except AdmissionRejectedError as e:
+            logger.warning(f"拒绝下载音频: {str(e)}")
+            yield event.plain_result(f"⚠️ 当前播放的人太多啦，请稍后再试或直接点击播放链接收听: {play_url}")
+        except AudioDownloadError as e:
+            logger.error(f"下载音频失败,状态码: {e.status}, 响应: {e.body}")
+            yield event.plain_result(f"❌ 音频下载失败(状态码: {e.status})")
         except asyncio.TimeoutError:
             logger.error("下载音频超时")
             yield event.plain_result(f"❌ 下载音频超时，请直接点击播放链接收听: {play_url}")
@@ -558,4 +2845,10 @@ class Main(Star):
             logger.error(f"下载或发送音频时发生错误: {str(e)}")
             import traceback
             logger.error(traceback.format_exc())
-            yield event.plain_result(f"❌ 发送音乐失败: {str(e)}\n请直接点击播放链接收听: {play_url}")
\ No newline at end of file
+            yield event.plain_result(f"❌ 发送音乐失败: {str(e)}\n请直接点击播放链接收听: {play_url}")
+        finally:
+            self.metrics.observe("play_total", time.perf_counter() - start)
+            if send_path:
+                await self.audio_transcoder.cache.release(send_path)
+            if audio_path:
+                await self.audio_cache.release(audio_path)
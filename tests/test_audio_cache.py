@@ -0,0 +1,55 @@
+"""AudioCache 固定与淘汰测试"""
+import asyncio
+import os
+
+import pytest
+
+pytest.importorskip("astrbot")
+
+from main import AudioCache  # noqa: E402
+
+
+def make_producer(delay: float = 0.0, size: int = 100):
+    async def produce(tmp_path: str) -> int:
+        await asyncio.sleep(delay)
+        with open(tmp_path, "wb") as f:
+            f.write(b"x" * size)
+        return size
+    return produce
+
+
+def test_produced_file_survives_concurrent_eviction(tmp_path):
+    """容量为 0 时，其他请求的 release 不能删除刚生成、尚未交给等待者的文件"""
+
+    async def scenario():
+        cache = AudioCache(str(tmp_path), 0, downloader=None)
+        held = await cache.acquire_with("a", make_producer())
+        tasks = [asyncio.create_task(cache.acquire_with("b", make_producer(0.05))) for _ in range(3)]
+        # 等到 b 生成完成、等待者尚未恢复时释放 a，触发淘汰
+        while len(cache._index) < 2:
+            await asyncio.sleep(0)
+        await cache.release(held)
+        paths = await asyncio.gather(*tasks)
+        assert all(os.path.exists(path) for path in paths)
+        for path in paths:
+            await cache.release(path)
+        assert not os.path.exists(paths[0])
+        assert cache._pinned == {}
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiter_does_not_leak_pin(tmp_path):
+    async def scenario():
+        cache = AudioCache(str(tmp_path), 0, downloader=None)
+        first = asyncio.create_task(cache.acquire_with("c", make_producer(0.05)))
+        second = asyncio.create_task(cache.acquire_with("c", make_producer(0.05)))
+        await asyncio.sleep(0.01)
+        second.cancel()
+        path = await first
+        assert cache._pinned == {path: 1}
+        await cache.release(path)
+        assert cache._pinned == {}
+        assert not os.path.exists(path)
+
+    asyncio.run(scenario())
@@ -0,0 +1,102 @@
+"""AdmissionScheduler 公平性测试"""
+import asyncio
+
+import pytest
+
+pytest.importorskip("astrbot")
+
+from main import AdmissionRejectedError, AdmissionScheduler  # noqa: E402
+
+
+def make_scheduler(**kwargs) -> AdmissionScheduler:
+    options = dict(limits={"search": 8, "render": 4, "audio": 4}, total_limit=12, queue_limit=32,
+                   per_session_limit=3, per_user_limit=2, per_session_queue_limit=8, per_user_queue_limit=4)
+    options.update(kwargs)
+    return AdmissionScheduler(**options)
+
+
+def test_flooding_user_does_not_block_other_users():
+    """同一用户的大量请求只拒绝该用户，其他用户在有空位时直接执行"""
+
+    async def scenario():
+        scheduler = make_scheduler()
+        release = asyncio.Event()
+        outcomes = []
+
+        async def search(session_id: str, user_id: str):
+            try:
+                async with scheduler.slot("search", session_id, user_id):
+                    outcomes.append(("ran", user_id))
+                    await release.wait()
+            except AdmissionRejectedError:
+                outcomes.append(("rejected", user_id))
+
+        flood = [asyncio.create_task(search("group", "alice")) for _ in range(34)]
+        await asyncio.sleep(0)
+        stats = scheduler.stats()
+        assert stats["search_running"] == 2
+        assert stats["search_queued"] == 4
+        assert outcomes.count(("rejected", "alice")) == 28
+
+        other = asyncio.create_task(search("other-group", "bob"))
+        await asyncio.sleep(0)
+        assert ("ran", "bob") in outcomes
+
+        release.set()
+        await asyncio.gather(*flood, other)
+        assert outcomes.count(("ran", "alice")) == 6
+        assert scheduler.stats()["search_running"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_session_queue_limit_rejects_only_that_session():
+    async def scenario():
+        scheduler = make_scheduler(per_user_queue_limit=0, per_session_queue_limit=2)
+        release = asyncio.Event()
+
+        async def hold(session_id: str, user_id: str):
+            async with scheduler.slot("audio", session_id, user_id):
+                await release.wait()
+
+        tasks = [asyncio.create_task(hold("group", f"user{i}")) for i in range(5)]
+        await asyncio.sleep(0)
+        # 会话并发上限 3，排队上限 2
+        assert scheduler.stats()["audio_running"] == 3
+        assert scheduler.stats()["audio_queued"] == 2
+        with pytest.raises(AdmissionRejectedError):
+            await hold("group", "user9")
+        other = asyncio.create_task(hold("private", "user9"))
+        await asyncio.sleep(0)
+        assert scheduler.stats()["audio_running"] == 4
+
+        release.set()
+        await asyncio.gather(*tasks, other)
+
+    asyncio.run(scenario())
+
+
+def test_priority_when_total_limit_frees_up():
+    """总并发已满时，空出的名额优先给排队的搜索"""
+
+    async def scenario():
+        scheduler = make_scheduler(total_limit=1)
+        order = []
+        first_done = asyncio.Event()
+
+        async def run(pool: str, user_id: str, wait: bool = False):
+            async with scheduler.slot(pool, user_id, user_id):
+                order.append(pool)
+                if wait:
+                    await first_done.wait()
+
+        holder = asyncio.create_task(run("audio", "u0", wait=True))
+        await asyncio.sleep(0)
+        audio = asyncio.create_task(run("audio", "u1"))
+        search = asyncio.create_task(run("search", "u2"))
+        await asyncio.sleep(0)
+        first_done.set()
+        await asyncio.gather(holder, audio, search)
+        assert order == ["audio", "search", "audio"]
+
+    asyncio.run(scenario())
@@ -0,0 +1,195 @@
+"""UpstreamClient 自适应超时与熔断测试（使用本地 aiohttp 服务模拟音乐 API）"""
+import asyncio
+
+import pytest
+
+pytest.importorskip("astrbot")
+
+import aiohttp  # noqa: E402
+from aiohttp import web  # noqa: E402
+
+from main import CircuitBreaker, UpstreamClient, UpstreamUnavailableError  # noqa: E402
+
+
+class FastUpstreamClient(UpstreamClient):
+    """缩小超时范围，让测试在毫秒级完成"""
+
+    DEFAULT_TIMEOUTS = {"search": 2.0, "cover": 2.0, "audio": 2.0}
+    MIN_TIMEOUTS = {"search": 0.05, "cover": 0.05, "audio": 0.05}
+
+
+async def start_server(delays: dict):
+    """启动本地服务，delays 为各路径的响应延迟(秒)，"fail" 中的路径返回 500，可在测试中修改"""
+
+    async def handle(request):
+        await asyncio.sleep(delays.get(request.path, 0))
+        if request.path in delays.get("fail", ()):
+            return web.Response(status=500)
+        return web.Response(body=b"ok")
+
+    app = web.Application()
+    app.router.add_route("*", "/{name}", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}"
+
+
+def test_timeout_backs_off_after_upstream_slows_down():
+    """超时收紧后上游变慢: 超时计入样本，超时逐步放宽直到请求重新成功"""
+
+    async def scenario():
+        delays = {"/cover": 0.0}
+        runner, base = await start_server(delays)
+        client = FastUpstreamClient(failure_threshold=100, hedge=False)
+        try:
+            async with aiohttp.ClientSession() as session:
+                for _ in range(client.MIN_SAMPLES):
+                    status, _ = await client.get_bytes(session, "cover", f"{base}/cover")
+                    assert status == 200
+                assert client.timeout("cover") == client.MIN_TIMEOUTS["cover"]
+
+                delays["/cover"] = 0.2
+                timeouts = 0
+                for _ in range(10):
+                    try:
+                        status, _ = await client.get_bytes(session, "cover", f"{base}/cover")
+                        break
+                    except asyncio.TimeoutError:
+                        timeouts += 1
+                else:
+                    pytest.fail("上游变慢后超时没有放宽")
+                assert status == 200
+                assert timeouts > 0
+                assert client.timeout("cover") > 0.2
+        finally:
+            await runner.cleanup()
+
+    asyncio.run(scenario())
+
+
+def test_half_open_probe_uses_default_timeout():
+    async def scenario():
+        delays = {"/cover": 0.0}
+        runner, base = await start_server(delays)
+        client = FastUpstreamClient(failure_threshold=1, reset_timeout=0.05, hedge=False)
+        breaker = client.breakers["cover"]
+        try:
+            async with aiohttp.ClientSession() as session:
+                for _ in range(client.MIN_SAMPLES):
+                    await client.get_bytes(session, "cover", f"{base}/cover")
+                breaker.record_failure()
+                assert breaker.state == "open"
+                await asyncio.sleep(0.06)
+                # 探测请求比收紧后的自适应超时慢，但在默认超时内，应成功并关闭熔断器
+                delays["/cover"] = 0.3
+                assert client.timeout("cover") == client.DEFAULT_TIMEOUTS["cover"]
+                status, _ = await client.get_bytes(session, "cover", f"{base}/cover")
+                assert status == 200
+                assert breaker.state == "closed"
+        finally:
+            await runner.cleanup()
+
+    asyncio.run(scenario())
+
+
+def test_breaker_transitions():
+    async def scenario():
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+        breaker.record_failure()
+        assert breaker.state == "closed"
+        breaker.record_failure()
+        assert breaker.state == "open"
+        with pytest.raises(UpstreamUnavailableError):
+            breaker.check()
+
+        await asyncio.sleep(0.06)
+        assert breaker.state == "half_open"
+        assert breaker.check() is True
+        # 探测进行中，其他请求仍被拒绝
+        with pytest.raises(UpstreamUnavailableError):
+            breaker.check()
+        breaker.record_failure()
+        assert breaker.state == "open"
+
+        await asyncio.sleep(0.06)
+        assert breaker.check() is True
+        breaker.record_success()
+        assert breaker.state == "closed"
+        assert breaker.check() is False
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_probe_does_not_leave_breaker_half_open():
+    async def scenario():
+        delays = {"/cover": 0.5}
+        runner, base = await start_server(delays)
+        client = FastUpstreamClient(failure_threshold=1, reset_timeout=0.05, hedge=False)
+        breaker = client.breakers["cover"]
+        try:
+            async with aiohttp.ClientSession() as session:
+                breaker.record_failure()
+                await asyncio.sleep(0.06)
+                probe = asyncio.create_task(client.get_bytes(session, "cover", f"{base}/cover"))
+                await asyncio.sleep(0.05)
+                probe.cancel()
+                with pytest.raises(asyncio.CancelledError):
+                    await probe
+
+                delays["/cover"] = 0.0
+                status, _ = await client.get_bytes(session, "cover", f"{base}/cover")
+                assert status == 200
+                assert breaker.state == "closed"
+        finally:
+            await runner.cleanup()
+
+    asyncio.run(scenario())
+
+
+def test_cover_failures_do_not_open_search_breaker():
+    async def scenario():
+        delays = {"fail": {"/cover"}}
+        runner, base = await start_server(delays)
+        client = FastUpstreamClient(failure_threshold=3, hedge=False)
+        try:
+            async with aiohttp.ClientSession() as session:
+                for _ in range(3):
+                    status, _ = await client.get_bytes(session, "cover", f"{base}/cover")
+                    assert status == 500
+                assert client.breakers["cover"].state == "open"
+                with pytest.raises(UpstreamUnavailableError):
+                    await client.get_bytes(session, "cover", f"{base}/cover")
+
+                async with client.request(session, "POST", "search", f"{base}/search") as response:
+                    assert response.status == 200
+                assert client.breakers["search"].state == "closed"
+        finally:
+            await runner.cleanup()
+
+    asyncio.run(scenario())
+
+
+def test_hedged_get_records_one_failure():
+    """首个请求和对冲请求都超时，只计一次失败"""
+
+    async def scenario():
+        delays = {"/cover": 0.0}
+        runner, base = await start_server(delays)
+        client = FastUpstreamClient(failure_threshold=100)
+        breaker = client.breakers["cover"]
+        try:
+            async with aiohttp.ClientSession() as session:
+                for _ in range(client.MIN_SAMPLES):
+                    await client.get_bytes(session, "cover", f"{base}/cover")
+                delays["/cover"] = 1.0
+                with pytest.raises(asyncio.TimeoutError):
+                    await client.get_bytes(session, "cover", f"{base}/cover")
+                assert client.hedges == 1
+                assert breaker.failures == 1
+        finally:
+            await runner.cleanup()
+
+    asyncio.run(scenario())